@@ -1,12 +1,22 @@
-from flask import Flask, render_template, redirect, url_for, flash, request, Response
+from flask import Flask, render_template, redirect, url_for, flash, request, Response, abort, stream_with_context
 from config import Config
 from datetime import date, timedelta
-from models import db, User, Area, Concepto, Gasto, PresupuestoMensual
-from forms import LoginForm, RegisterForm, AreaForm, ConceptoForm, GastoForm
+from models import db, User, Area, Concepto, Gasto, PresupuestoMensual, GastoMensual, reconstruir_gasto_mensual, \
+    guardar_presupuestos_mensuales, actualizar_esquema
+from forms import LoginForm, RegisterForm, AreaForm, ConceptoForm, GastoForm, FiltroGastosForm, ImportarGastosForm
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user
+from sqlalchemy.orm import joinedload
+from reportes import construir_reporte_mes, generar_csv, filas_csv_mes, filas_csv_rango, marca_modificacion
+from importacion import importar_gastos_csv, ImportacionInvalida
+from lecturas import consulta_gastos, filas_gastos, gastos_recientes, totales_presupuesto, usuarios_con_pagado, \
+    opciones_conceptos, opciones_usuarios, nombres_equivalentes
+from cache import cache_respuestas, cache_respuesta, respuesta_condicional
+from basedatos import configurar_sqlite, reintentar_escritura, EstadisticasPool
+from instrumentacion import InstrumentacionSQL
+from metricas import Metricas
+from perfilador import Perfilador, MemoriaPorPeticion
+import io
 import os
-import unicodedata
-import re
 
 app = Flask(__name__)
 app.config.from_object(Config)
@@ -15,6 +25,23 @@ app.config.from_object(Config)
 os.makedirs(os.path.join(os.path.dirname(__file__), 'instance'), exist_ok=True)
 
 db.init_app(app)
+configurar_sqlite(app)
+if app.config.get('ACTUALIZAR_ESQUEMA', True):
+    # Las vistas leen gasto_mensual, marca_cambios y columnas agregadas después de la base original
+    with app.app_context():
+        actualizar_esquema()
+cache_respuestas.init_app(app)
+pool_db = EstadisticasPool(app)
+instrumentacion_sql = InstrumentacionSQL(app)
+metricas = Metricas(app) if app.config.get('METRICAS', True) else None
+perfilador = Perfilador(app)
+memoria = MemoriaPorPeticion(app)
+if metricas is not None:
+    metricas.agregar_colector(pool_db.lineas_metricas)
+    if perfilador.continuo is not None:
+        metricas.agregar_colector(perfilador.continuo.lineas_metricas)
+    if memoria.habilitado:
+        metricas.agregar_colector(memoria.lineas_metricas)
 login_manager = LoginManager(app)
 login_manager.login_view = 'login'
 
@@ -31,9 +58,10 @@ def register():
     form = RegisterForm()
     if form.validate_on_submit():
         # NOTE: for demo we store password as-is. For production, hash with werkzeug.security
-        user = User(name=form.name.data, email=form.email.data, password=form.password.data, aporte=form.aporte.data)
-        db.session.add(user)
-        db.session.commit()
+        reintentar_escritura(lambda: db.session.add(
+            User(name=form.name.data, email=form.email.data, password=form.password.data, aporte=form.aporte.data)
+        ))
+        cache_respuestas.invalidar()
         flash('Usuario registrado. Por favor inicia sesión.', 'success')
         return redirect(url_for('login'))
     return render_template('register.html', form=form)
@@ -61,9 +89,8 @@ def logout():
 def areas_view():
     form = AreaForm()
     if form.validate_on_submit():
-        area = Area(nombre=form.nombre.data)
-        db.session.add(area)
-        db.session.commit()
+        reintentar_escritura(lambda: db.session.add(Area(nombre=form.nombre.data)))
+        cache_respuestas.invalidar()
         flash('Área creada', 'success')
         return redirect(url_for('areas_view'))
     areas = Area.query.all()
@@ -72,23 +99,19 @@ def areas_view():
 # Dashboard
 @app.route('/dashboard')
 @login_required
+@cache_respuesta
 def dashboard():
-    areas = Area.query.all()
-    conceptos = Concepto.query.all()
-    gastos = Gasto.query.order_by(Gasto.fecha.desc()).limit(30).all()
-
-    total_presupuestado = sum(c.valor_presupuestado for c in conceptos)
-    total_gastado = sum(c.total_gastado for c in conceptos)
+    # Solo lecturas por columnas (ver lecturas.py): totales, últimos gastos y usuarios
+    total_presupuestado, total_gastado = totales_presupuesto()
     total_restante = max(total_presupuestado - total_gastado, 0)
+    gastos = gastos_recientes(30)
 
-    usuarios = User.query.all()
     aporte_info = []
-    for u in usuarios:
+    for u in usuarios_con_pagado():
         aport_expected = total_presupuestado * u.aporte
-        aport_paid = sum(g.monto for g in u.gastos)
-        aporte_info.append({'user': u, 'expected': aport_expected, 'paid': aport_paid, 'diff': aport_paid - aport_expected})
+        aporte_info.append({'user': u, 'expected': aport_expected, 'paid': u.pagado, 'diff': u.pagado - aport_expected})
 
-    return render_template('dashboard.html', areas=areas, conceptos=conceptos, gastos=gastos,
+    return render_template('dashboard.html', gastos=gastos,
                            total_presupuestado=total_presupuestado, total_gastado=total_gastado,
                            total_restante=total_restante, aporte_info=aporte_info)
 
@@ -112,22 +135,23 @@ def presupuestar_mes_siguiente():
     prev_month_label = f"{month_name[last_month_first_day.month]} {last_month_first_day.year}"
     next_month_label = f"{month_name[next_month_first_day.month]} {next_month_first_day.year}"
 
-    conceptos = Concepto.query.all()
-    sugerencias = []
-    for c in conceptos:
-        # Gastado en el mes anterior al objetivo
-        gastado_prev = sum(
-            g.monto for g in c.gastos
-            if g.fecha.date() >= last_month_first_day and g.fecha.date() <= prev_month_last_day
+    # Una sola lectura: concepto, presupuesto y gastado del mes anterior al objetivo
+    pm = PresupuestoMensual
+    gm = GastoMensual
+    prev_y, prev_m = last_month_first_day.year, last_month_first_day.month
+    filas = db.session.execute(
+        db.select(
+            Concepto.id,
+            Concepto.nombre,
+            db.func.coalesce(pm.valor_presupuestado, Concepto.valor_presupuestado),
+            db.func.coalesce(gm.total, 0),
         )
-        # Presupuesto del mes anterior al objetivo (si existe en PresupuestoMensual)
-        pm_prev = PresupuestoMensual.query.filter_by(
-            concepto_id=c.id,
-            year=last_month_first_day.year,
-            month=last_month_first_day.month
-        ).first()
-        presupuestado_prev = pm_prev.valor_presupuestado if pm_prev else c.valor_presupuestado
-
+        .outerjoin(pm, db.and_(pm.concepto_id == Concepto.id, pm.year == prev_y, pm.month == prev_m))
+        .outerjoin(gm, db.and_(gm.concepto_id == Concepto.id, gm.year == prev_y, gm.month == prev_m))
+        .order_by(Concepto.id)
+    ).all()
+    sugerencias = []
+    for concepto_id, nombre, presupuestado_prev, gastado_prev in filas:
         # Regla: si gastó más que el presupuesto previo, sugerir subir a lo gastado;
         # si gastó menos, sugerir bajar a lo gastado; si igual, mantener.
         if gastado_prev > presupuestado_prev:
@@ -138,24 +162,21 @@ def presupuestar_mes_siguiente():
             sugerido = presupuestado_prev
 
         sugerencias.append({
-            'id': c.id,
-            'nombre': c.nombre,
+            'id': concepto_id,
+            'nombre': nombre,
             'presupuestado_anterior': presupuestado_prev,
             'gastado_anterior': gastado_prev,
             'sugerido': sugerido
         })
 
     if request.method == 'POST':
-        for s in sugerencias:
-            nuevo_valor = float(request.form.get(f'presupuesto_{s["id"]}', s['sugerido']))
-            # upsert presupuesto mensual para el siguiente mes
-            pm = PresupuestoMensual.query.filter_by(concepto_id=s['id'], year=next_month_first_day.year, month=next_month_first_day.month).first()
-            if not pm:
-                pm = PresupuestoMensual(concepto_id=s['id'], year=next_month_first_day.year, month=next_month_first_day.month, valor_presupuestado=nuevo_valor)
-                db.session.add(pm)
-            else:
-                pm.valor_presupuestado = nuevo_valor
-        db.session.commit()
+        valores = {
+            s['id']: float(request.form.get(f'presupuesto_{s["id"]}', s['sugerido']))
+            for s in sugerencias
+        }
+        # upsert de todos los presupuestos del siguiente mes en una sola sentencia
+        reintentar_escritura(lambda: guardar_presupuestos_mensuales(next_month_first_day.year, next_month_first_day.month, valores))
+        cache_respuestas.invalidar()
         flash(f'Presupuesto de {next_month_label} guardado', 'success')
         return redirect(url_for('conceptos_view'))
 
@@ -167,24 +188,38 @@ def editar_area(area_id):
     area = Area.query.get_or_404(area_id)
     form = AreaForm(obj=area)
     if form.validate_on_submit():
-        area.nombre = form.nombre.data
-        db.session.commit()
+        def escribir():
+            area.nombre = form.nombre.data
+        reintentar_escritura(escribir)
+        cache_respuestas.invalidar()
         flash('Área actualizada', 'success')
         return redirect(url_for('areas_view'))
     return render_template('areas.html', form=form, areas=Area.query.all(), editar_area=area)
 
+def advertir_nombres_equivalentes(nombre, excluir_id=None):
+    # Se permite guardar: los reportes agrupan los conceptos con el mismo nombre normalizado
+    equivalentes = nombres_equivalentes(nombre, excluir_id)
+    if equivalentes:
+        flash(
+            f'Ya existe un concepto con un nombre equivalente ({", ".join(equivalentes)}); '
+            f'los reportes los mostrarán agrupados.',
+            'warning'
+        )
+
 @app.route('/conceptos', methods=['GET', 'POST'])
 @login_required
 def conceptos_view():
     form = ConceptoForm()
     form.area_id.choices = [(a.id, a.nombre) for a in Area.query.order_by(Area.nombre).all()]
     if form.validate_on_submit():
-        c = Concepto(nombre=form.nombre.data, valor_presupuestado=form.valor_presupuestado.data, area_id=form.area_id.data)
-        db.session.add(c)
-        db.session.commit()
+        advertir_nombres_equivalentes(form.nombre.data)
+        reintentar_escritura(lambda: db.session.add(
+            Concepto(nombre=form.nombre.data, valor_presupuestado=form.valor_presupuestado.data, area_id=form.area_id.data)
+        ))
+        cache_respuestas.invalidar()
         flash('Concepto creado', 'success')
         return redirect(url_for('conceptos_view'))
-    conceptos = Concepto.query.all()
+    conceptos = Concepto.con_totales().options(joinedload(Concepto.area)).all()
     return render_template('conceptos.html', form=form, conceptos=conceptos)
 
 # Editar Concepto
@@ -195,21 +230,28 @@ def editar_concepto(concepto_id):
     form = ConceptoForm(obj=concepto)
     form.area_id.choices = [(a.id, a.nombre) for a in Area.query.order_by(Area.nombre).all()]
     if form.validate_on_submit():
-        concepto.nombre = form.nombre.data
-        concepto.valor_presupuestado = form.valor_presupuestado.data
-        concepto.area_id = form.area_id.data
-        db.session.commit()
+        advertir_nombres_equivalentes(form.nombre.data, excluir_id=concepto.id)
+        def escribir():
+            concepto.nombre = form.nombre.data
+            concepto.valor_presupuestado = form.valor_presupuestado.data
+            concepto.area_id = form.area_id.data
+        reintentar_escritura(escribir)
+        cache_respuestas.invalidar()
         flash('Concepto actualizado', 'success')
         return redirect(url_for('conceptos_view'))
-    return render_template('conceptos.html', form=form, conceptos=Concepto.query.all(), editar_concepto=concepto)
+    conceptos = Concepto.con_totales().options(joinedload(Concepto.area)).all()
+    return render_template('conceptos.html', form=form, conceptos=conceptos, editar_concepto=concepto)
 
 # Eliminar Concepto
 @app.route('/conceptos/eliminar/<int:concepto_id>', methods=['POST'])
 @login_required
 def eliminar_concepto(concepto_id):
     concepto = Concepto.query.get_or_404(concepto_id)
-    gastos_asociados = len(concepto.gastos)
-    presupuestos_asociados = len(getattr(concepto, 'presupuestos_mensuales', []))
+    # Conteos en SQL: cargar las colecciones solo para medirlas traería todo el historial
+    gastos_asociados = db.session.scalar(db.select(db.func.count(Gasto.id)).filter_by(concepto_id=concepto.id))
+    presupuestos_asociados = db.session.scalar(
+        db.select(db.func.count(PresupuestoMensual.id)).filter_by(concepto_id=concepto.id)
+    )
 
     if gastos_asociados > 0 or presupuestos_asociados > 0:
         flash(
@@ -219,8 +261,12 @@ def eliminar_concepto(concepto_id):
         )
         return redirect(url_for('conceptos_view'))
 
-    db.session.delete(concepto)
-    db.session.commit()
+    def escribir():
+        # Meses que quedaron en cero en el acumulado (sus gastos ya fueron eliminados)
+        GastoMensual.query.filter_by(concepto_id=concepto.id).delete()
+        db.session.delete(concepto)
+    reintentar_escritura(escribir)
+    cache_respuestas.invalidar()
     flash('Concepto eliminado', 'success')
     return redirect(url_for('conceptos_view'))
 
@@ -252,23 +298,31 @@ def usuarios_view():
             return redirect(url_for('usuarios_view'))
         
         # Actualizar los aportes
-        for u in usuarios:
-            u.aporte = nuevos_aportes[u.id]
-        
-        db.session.commit()
+        def escribir():
+            for u in usuarios:
+                u.aporte = nuevos_aportes[u.id]
+        reintentar_escritura(escribir)
+        cache_respuestas.invalidar()
         flash('Aportes actualizados correctamente', 'success')
         return redirect(url_for('usuarios_view'))
     
     # Calcular suma actual de aportes
     total_actual = sum(u.aporte for u in usuarios) * 100
+    # Cantidad y total de gastos por usuario en una sola consulta agregada
+    resumen_gastos = {
+        usuario_id: (cantidad, total)
+        for usuario_id, cantidad, total in db.session.execute(
+            db.select(Gasto.usuario_id, db.func.count(Gasto.id), db.func.sum(Gasto.monto)).group_by(Gasto.usuario_id)
+        )
+    }
     
-    return render_template('usuarios.html', usuarios=usuarios, total_actual=total_actual)
+    return render_template('usuarios.html', usuarios=usuarios, total_actual=total_actual, resumen_gastos=resumen_gastos)
 
 @app.route('/gastos', methods=['GET', 'POST'])
 @login_required
 def gastos_view():
     form = GastoForm()
-    form.concepto_id.choices = [(c.id, f"{c.nombre} ({c.area.nombre})") for c in Concepto.query.all()]
+    form.concepto_id.choices = opciones_conceptos()
     # Establecer fecha actual como valor por defecto
     if request.method == 'GET':
         form.fecha.data = datetime.today().date()
@@ -284,7 +338,8 @@ def gastos_view():
         presupuesto_mes = pm.valor_presupuestado if pm else concepto.valor_presupuestado
 
         # Calcular total gastado en ese mes (sin incluir el gasto actual)
-        gastado_mes = sum(g.monto for g in concepto.gastos if g.fecha.year == year and g.fecha.month == month)
+        gm = db.session.get(GastoMensual, (concepto.id, year, month))
+        gastado_mes = gm.total if gm else 0
 
         # Calcular lo que quedaría disponible antes de este gasto
         disponible = presupuesto_mes - gastado_mes
@@ -297,16 +352,102 @@ def gastos_view():
                 'warning'
             )
 
-        gasto = Gasto(concepto_id=form.concepto_id.data, usuario_id=current_user.id, monto=form.monto.data, fecha=fecha_gasto)
-        db.session.add(gasto)
-        db.session.commit()
+        reintentar_escritura(lambda: db.session.add(
+            Gasto(concepto_id=form.concepto_id.data, usuario_id=current_user.id, monto=form.monto.data, fecha=fecha_gasto)
+        ))
+        cache_respuestas.invalidar()
         flash('Gasto registrado', 'success')
         return redirect(url_for('gastos_view'))
-    gastos = Gasto.query.order_by(Gasto.fecha.desc()).all()
-    return render_template('gastos.html', form=form, gastos=gastos)
+
+    filtros = FiltroGastosForm(formdata=request.args)
+    filtros.concepto_id.choices = [(0, 'Todos')] + [(c_id, label) for c_id, label in form.concepto_id.choices]
+    filtros.usuario_id.choices = [(0, 'Todos')] + opciones_usuarios()
+    gastos, siguiente_cursor = paginar_gastos(filtros, request.args.get('cursor'))
+    args = request.args.to_dict()
+    cursor_actual = args.pop('cursor', None)
+    primera_url = url_for('gastos_view', **args) if cursor_actual else None
+    siguiente_url = url_for('gastos_view', cursor=siguiente_cursor, **args) if siguiente_cursor else None
+    return render_template('gastos.html', form=form, gastos=gastos, filtros=filtros,
+                           primera_url=primera_url, siguiente_url=siguiente_url)
+
+@app.route('/gastos/importar', methods=['GET', 'POST'])
+@login_required
+def importar_gastos():
+    form = ImportarGastosForm()
+    resultado = None
+    if form.validate_on_submit():
+        # Se lee una vez para poder repetir la importación completa si la base está bloqueada
+        contenido = form.archivo.data.read()
+        try:
+            resultado = reintentar_escritura(lambda: importar_gastos_csv(io.BytesIO(contenido), current_user.id))
+        except ImportacionInvalida as exc:
+            # Descarta los lotes que alcanzaron a insertarse antes del primer error
+            db.session.rollback()
+            resultado = exc.resultado
+            flash(f'No se importó ningún gasto: {resultado.total_errores} error(es) en el archivo', 'danger')
+        else:
+            for advertencia in resultado.advertencias:
+                flash(advertencia, 'warning')
+            cache_respuestas.invalidar()
+            flash(f'{resultado.insertados} gasto(s) importados', 'success')
+            return redirect(url_for('gastos_view'))
+    return render_template('importar_gastos.html', form=form, resultado=resultado)
+
+def paginar_gastos(filtros, cursor):
+    # Paginación por cursor (keyset) sobre (fecha, id) descendente: cada página es un
+    # recorrido acotado de ix_gasto_fecha / ix_gasto_concepto_fecha / ix_gasto_usuario_fecha,
+    # sin OFFSET, así que cuesta lo mismo sin importar cuántos gastos existan. Un rango de
+    # montos con mínimo y máximo usa ix_gasto_monto; con un solo límite SQLite prefiere
+    # recorrer ix_gasto_fecha en orden, rápido salvo que casi ningún gasto cumpla el filtro.
+    query = consulta_gastos()
+    if filtros.validate():
+        if filtros.concepto_id.data:
+            query = query.filter(Gasto.concepto_id == filtros.concepto_id.data)
+        if filtros.usuario_id.data:
+            query = query.filter(Gasto.usuario_id == filtros.usuario_id.data)
+        if filtros.desde.data:
+            query = query.filter(Gasto.fecha >= datetime.combine(filtros.desde.data, datetime.min.time()))
+        if filtros.hasta.data:
+            query = query.filter(Gasto.fecha < datetime.combine(filtros.hasta.data + timedelta(days=1), datetime.min.time()))
+        if filtros.monto_min.data is not None:
+            query = query.filter(Gasto.monto >= filtros.monto_min.data)
+        if filtros.monto_max.data is not None:
+            query = query.filter(Gasto.monto <= filtros.monto_max.data)
+
+    if cursor:
+        try:
+            fecha_str, _, id_str = cursor.rpartition('_')
+            query = query.filter(db.tuple_(Gasto.fecha, Gasto.id) < (datetime.fromisoformat(fecha_str), int(id_str)))
+        except ValueError:
+            pass  # cursor inválido: se muestra la primera página
+
+    por_pagina = app.config['GASTOS_POR_PAGINA']
+    gastos = filas_gastos(query.order_by(Gasto.fecha.desc(), Gasto.id.desc()).limit(por_pagina + 1))
+    siguiente_cursor = None
+    if len(gastos) > por_pagina:
+        gastos = gastos[:por_pagina]
+        ultimo = gastos[-1]
+        siguiente_cursor = f"{ultimo.fecha.isoformat()}_{ultimo.id}"
+    return gastos, siguiente_cursor
+
+def _meses_solicitados_reporte():
+    # Meses (desde, hasta) que abarca la respuesta de reporte_mes según el querystring
+    if request.args.get('format') == 'csv' and (request.args.get('from') or request.args.get('to')):
+        return _parse_mes(request.args.get('from')), _parse_mes(request.args.get('to'))
+    today = datetime.today().date()
+    mes = (request.args.get('year', type=int) or today.year, request.args.get('month', type=int) or today.month)
+    return mes, mes
+
+def validador_reporte_mes():
+    desde, hasta = _meses_solicitados_reporte()
+    if not desde or not hasta:
+        return None, None
+    return marca_modificacion(desde, hasta, variante=sorted(request.args.items(multi=True)))
 
 @app.route('/reporte_mes')
 @login_required
+@respuesta_condicional(validador_reporte_mes)
+@cache_respuesta
 def reporte_mes():
     # Selección de mes/año por querystring, por defecto mes/año actuales
     y = request.args.get('year', type=int)
@@ -316,153 +457,76 @@ def reporte_mes():
         y = today.year
     if not m:
         m = today.month
+    if not _mes_valido(y, m):
+        abort(400)
 
     # Calcular mes anterior y siguiente para navegación
     prev_y, prev_m = (y - 1, 12) if m == 1 else (y, m - 1)
     next_y, next_m = (y + 1, 1) if m == 12 else (y, m + 1)
 
-    conceptos = Concepto.query.all()
-    # Agrupar por nombre de concepto (normalizado: trim, colapsar espacios, sin acentos, lower)
-    group_map = {}
-    for c in conceptos:
-        raw_name = (c.nombre or '')
-        name_strip = raw_name.strip()
-        name_collapsed = re.sub(r"\s+", " ", name_strip)
-        name_nfd = unicodedata.normalize('NFD', name_collapsed)
-        name_no_accents = ''.join(ch for ch in name_nfd if unicodedata.category(ch) != 'Mn')
-        key = name_no_accents.lower()
-
-        # Presupuesto mensual si existe, si no usar el valor base del concepto
-        pm = PresupuestoMensual.query.filter_by(concepto_id=c.id, year=y, month=m).first()
-        presup_c = pm.valor_presupuestado if pm else c.valor_presupuestado
-
-        # Gastos del mes/año seleccionados para este concepto
-        gastos_mes_c = [g for g in c.gastos if g.fecha.year == y and g.fecha.month == m]
-        gastado_c = sum(g.monto for g in gastos_mes_c)
-
-        if key not in group_map:
-            group_map[key] = {
-                'concepto_name': name_collapsed if name_collapsed else c.nombre,
-                'area_name': c.area.nombre if c.area else '',
-                'presupuestado': 0.0,
-                'gastado': 0.0,
-                'gastos': [],
-                'group_key': key.replace(' ', '-'),
-                'source_count': 0,
-            }
-        group_map[key]['presupuestado'] += float(presup_c or 0)
-        group_map[key]['gastado'] += float(gastado_c or 0)
-        group_map[key]['gastos'].extend(gastos_mes_c)
-        group_map[key]['source_count'] += 1
-
-    # Construir reporte final desde los grupos
-    report = []
-    total_pres = 0.0
-    total_gasto = 0.0
-    total_pend = 0.0
-    total_exceso = 0.0
-    counts = { 'green': 0, 'yellow': 0, 'lilac': 0, 'orange': 0, 'red': 0 }
-
-    for g in group_map.values():
-        presupuestado = g['presupuestado']
-        gastado = g['gastado']
-        pendiente = presupuestado - gastado
-        exceso = max(gastado - presupuestado, 0)
-
-        # Clasificar estado para contador
-        if pendiente < 0:
-            counts['red'] += 1
-            state = 'red'
-        elif pendiente == 0:
-            counts['green'] += 1
-            state = 'green'
-        elif presupuestado > 0 and pendiente == presupuestado:
-            counts['yellow'] += 1
-            state = 'yellow'
-        else:
-            ratio = 0 if presupuestado == 0 else (pendiente / presupuestado)
-            if ratio < 0.2:
-                counts['lilac'] += 1
-                state = 'lilac'
-            else:
-                counts['orange'] += 1
-                state = 'orange'
-
-        total_pres += presupuestado
-        total_gasto += gastado
-        total_pend += pendiente
-        total_exceso += exceso
-
-        report.append({
-            'area_name': g['area_name'],
-            'concepto_name': g['concepto_name'],
-            'presupuestado': presupuestado,
-            'gastado': gastado,
-            'pendiente': pendiente,
-            'exceso': exceso,
-            'state': state,
-            'gastos': g['gastos'],
-            'group_key': g['group_key'],
-            'source_count': g['source_count'],
-        })
-
-    month_label = f"{month_name[m]} {y}"
-
-    # Calcular aporte esperado por usuario
-    usuarios = User.query.all()
-    aportes_usuarios = []
-    for u in usuarios:
-        aporte_esperado = total_pres * u.aporte
-        aportes_usuarios.append({
-            'nombre': u.name,
-            'porcentaje': u.aporte * 100,
-            'aporte_esperado': aporte_esperado
-        })
-
-    # Exportar CSV si se solicita
+    # Exportar CSV si se solicita (un mes, o un rango con from=YYYY-MM&to=YYYY-MM)
     if request.args.get('format') == 'csv':
-        import io, csv
-        output = io.StringIO()
-        writer = csv.writer(output)
-        writer.writerow(['Año', 'Mes', 'Área', 'Concepto', 'Presupuestado', 'Gastado', 'Pendiente', 'Exceso'])
-        for row in report:
-            writer.writerow([
-                y,
-                m,
-                row['area_name'],
-                row['concepto_name'],
-                int(round(row['presupuestado'])),
-                int(round(row['gastado'])),
-                int(round(row['pendiente'])),
-                int(round(row['exceso'])),
-            ])
-        writer.writerow([])
-        writer.writerow(['Totales', '', '', '', int(round(total_pres)), int(round(total_gasto)), int(round(total_pend)), int(round(total_exceso))])
-        csv_data = output.getvalue()
-        output.close()
+        if request.args.get('from') or request.args.get('to'):
+            desde = _parse_mes(request.args.get('from'))
+            hasta = _parse_mes(request.args.get('to'))
+            if not desde or not hasta or desde > hasta:
+                abort(400)
+            # Cada mes del rango cuesta dos consultas: se acota para no ocupar un worker por minutos
+            if (hasta[0] - desde[0]) * 12 + hasta[1] - desde[1] + 1 > app.config['REPORTE_MAX_MESES']:
+                abort(400)
+            filas = filas_csv_rango(desde, hasta)
+            filename = f"reporte_{desde[0]}-{desde[1]:02d}_{hasta[0]}-{hasta[1]:02d}.csv"
+        else:
+            filas = filas_csv_mes(y, m)
+            filename = f"reporte_{y}-{m:02d}.csv"
         return Response(
-            csv_data,
+            stream_with_context(generar_csv(filas)),
             mimetype='text/csv',
-            headers={'Content-Disposition': f'attachment; filename="reporte_{y}-{m:02d}.csv"'}
+            headers={'Content-Disposition': f'attachment; filename="{filename}"'}
         )
 
+    datos = construir_reporte_mes(y, m)
+    month_label = f"{month_name[m]} {y}"
+
     return render_template(
         'reporte_mes.html',
-        report=report,
         year=y,
         month=m,
         month_label=month_label,
-        total_pres=total_pres,
-        total_gasto=total_gasto,
-        total_pend=total_pend,
-        total_exceso=total_exceso,
         prev_y=prev_y,
         prev_m=prev_m,
         next_y=next_y,
         next_m=next_m,
-        counts=counts,
-        aportes_usuarios=aportes_usuarios,
+        **datos,
     )
 
+def _mes_valido(y, m):
+    # rango_mes necesita el primer día del mes siguiente, que datetime admite hasta el año 9999
+    return 1 <= y <= 9998 and 1 <= m <= 12
+
+def _parse_mes(valor):
+    # 'YYYY-MM' -> (year, month); None si no es válido
+    try:
+        y, m = (int(p) for p in (valor or '').split('-'))
+    except ValueError:
+        return None
+    if not _mes_valido(y, m):
+        return None
+    return y, m
+
+@app.cli.command('actualizar-esquema')
+def actualizar_esquema_command():
+    """Crea las tablas, columnas e índices que falten."""
+    actualizar_esquema()
+    print('Esquema actualizado')
+
+
+@app.cli.command('reconstruir-gastos-mensuales')
+def reconstruir_gastos_mensuales_command():
+    """Recalcula la tabla de acumulados mensuales de gastos."""
+    db.create_all()
+    reconstruir_gasto_mensual()
+    print('Acumulados mensuales reconstruidos')
+
 if __name__ == '__main__':
     app.run(debug=True, host='0.0.0.0', port=5002)
\ No newline at end of file
@@ -0,0 +1,152 @@
+import random
+import threading
+import time
+
+from flask import current_app
+from sqlalchemy import event
+from sqlalchemy.exc import OperationalError
+
+from models import db, marcar_cambio
+
+
+def _pragmas_sqlite(config, en_memoria):
+    pragmas = [
+        ('busy_timeout', int(config.get('SQLITE_BUSY_TIMEOUT_MS', 5000))),
+        ('synchronous', config.get('SQLITE_SYNCHRONOUS', 'NORMAL')),
+        ('cache_size', int(config.get('SQLITE_CACHE_SIZE', -64000))),
+        ('temp_store', config.get('SQLITE_TEMP_STORE', 'MEMORY')),
+    ]
+    if not en_memoria:
+        # WAL y mmap solo tienen sentido sobre un archivo
+        pragmas.insert(0, ('journal_mode', config.get('SQLITE_JOURNAL_MODE', 'WAL')))
+        pragmas.append(('mmap_size', int(config.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024))))
+    return pragmas
+
+
+def configurar_sqlite(app):
+    # Perfil de producción para SQLite, aplicado a cada conexión nueva del pool. Con WAL
+    # los lectores (reportes) no bloquean al escritor ni el escritor a los lectores, y
+    # busy_timeout hace que un segundo escritor espere en lugar de fallar de inmediato.
+    if not app.config.get('SQLITE_PRAGMAS', True):
+        return
+    with app.app_context():
+        for engine in db.engines.values():
+            if engine.dialect.name != 'sqlite':
+                continue
+            pragmas = _pragmas_sqlite(app.config, engine.url.database in (None, '', ':memory:'))
+
+            def aplicar(dbapi_connection, connection_record, pragmas=pragmas):
+                cursor = dbapi_connection.cursor()
+                for nombre, valor in pragmas:
+                    cursor.execute(f'PRAGMA {nombre} = {valor}')
+                cursor.close()
+
+            event.listen(engine, 'connect', aplicar)
+
+
+def es_bloqueo(exc):
+    mensaje = str(getattr(exc, 'orig', exc)).lower()
+    return isinstance(exc, OperationalError) and ('database is locked' in mensaje or 'database is busy' in mensaje)
+
+
+def reintentar_escritura(escribir):
+    # Ejecuta escribir() y confirma la transacción. Si SQLite sigue bloqueada después de
+    # busy_timeout, deshace y reintenta con espera exponencial (con jitter) hasta
+    # ESCRITURA_REINTENTOS veces. escribir() debe aplicar todos sus cambios en cada llamada:
+    # el rollback expira lo que hubiera quedado pendiente en la sesión. En la misma
+    # transacción se avanza la marca 'datos', que invalida la cache de respuestas de todos
+    # los procesos (ver cache.py).
+    intentos = current_app.config.get('ESCRITURA_REINTENTOS', 5)
+    espera = current_app.config.get('ESCRITURA_ESPERA', 0.05)
+    for intento in range(1, intentos + 1):
+        try:
+            resultado = escribir()
+            marcar_cambio(db.session.connection(), 'datos')
+            db.session.commit()
+            return resultado
+        except OperationalError as exc:
+            db.session.rollback()
+            if not es_bloqueo(exc) or intento == intentos:
+                raise
+            pausa = espera * 2 ** (intento - 1) * random.uniform(0.5, 1.5)
+            current_app.logger.warning('Base de datos bloqueada, reintento %d de %d en %.0f ms',
+                                       intento, intentos - 1, pausa * 1000)
+            time.sleep(pausa)
+
+
+class EstadisticasPool:
+    # Estado y contadores del pool de conexiones, para dimensionarlo según los trabajadores.
+    # Si el pico de conexiones en uso llega a pool_size + max_overflow, o crecen las esperas
+    # agotadas, el pool es chico para los hilos del proceso; si el pico queda muy por debajo
+    # de pool_size, sobran conexiones abiertas.
+
+    def __init__(self, app=None):
+        self._lock = threading.Lock()
+        self.creadas = 0
+        self.retiros = 0
+        self.invalidadas = 0
+        self.pico = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        with app.app_context():
+            self.pool = db.engine.pool
+        event.listen(self.pool, 'connect', self._conexion_creada)
+        event.listen(self.pool, 'checkout', self._retiro)
+        event.listen(self.pool, 'invalidate', self._invalidada)
+
+    def _conexion_creada(self, dbapi_connection, connection_record):
+        with self._lock:
+            self.creadas += 1
+
+    def _retiro(self, dbapi_connection, connection_record, connection_proxy):
+        en_uso = self._medir('checkedout')
+        with self._lock:
+            self.retiros += 1
+            if en_uso is not None and en_uso > self.pico:
+                self.pico = en_uso
+
+    def _invalidada(self, dbapi_connection, connection_record, exception):
+        with self._lock:
+            self.invalidadas += 1
+
+    def _medir(self, nombre):
+        # Solo QueuePool expone tamaño, desborde y conexiones en uso
+        metodo = getattr(self.pool, nombre, None)
+        return metodo() if metodo is not None else None
+
+    def estadisticas(self):
+        desborde = self._medir('overflow')
+        return {
+            'pool': type(self.pool).__name__,
+            'tamano': self._medir('size'),
+            'desborde_max': getattr(self.pool, '_max_overflow', None),
+            'en_uso': self._medir('checkedout'),
+            'disponibles': self._medir('checkedin'),
+            # QueuePool.overflow() es negativo mientras no se abrieron pool_size conexiones
+            'desborde': max(desborde, 0) if desborde is not None else None,
+            'pico_en_uso': self.pico,
+            'creadas': self.creadas,
+            'retiros': self.retiros,
+            'invalidadas': self.invalidadas,
+        }
+
+    def lineas_metricas(self):
+        e = self.estadisticas()
+        metricas = [
+            ('presupuesto_db_pool_tamano', 'gauge', 'Conexiones persistentes del pool (pool_size).', e['tamano']),
+            ('presupuesto_db_pool_desborde_max', 'gauge', 'Conexiones extra permitidas (max_overflow).', e['desborde_max']),
+            ('presupuesto_db_conexiones_activas', 'gauge', 'Conexiones del pool en uso.', e['en_uso']),
+            ('presupuesto_db_conexiones_disponibles', 'gauge', 'Conexiones abiertas sin usar.', e['disponibles']),
+            ('presupuesto_db_conexiones_pico', 'gauge', 'Máximo de conexiones en uso a la vez desde el arranque.', e['pico_en_uso']),
+            ('presupuesto_db_conexiones_creadas_total', 'counter', 'Conexiones abiertas contra la base.', e['creadas']),
+            ('presupuesto_db_retiros_total', 'counter', 'Conexiones entregadas por el pool.', e['retiros']),
+            ('presupuesto_db_conexiones_invalidadas_total', 'counter', 'Conexiones descartadas por error.', e['invalidadas']),
+        ]
+        lineas = []
+        for nombre, tipo, ayuda, valor in metricas:
+            if valor is None:
+                continue
+            lineas += [f'# HELP {nombre} {ayuda}', f'# TYPE {nombre} {tipo}', f'{nombre} {valor}']
+        return lineas
@@ -0,0 +1,236 @@
+"""Benchmark de las rutas principales contra bases generadas de varios tamaños.
+
+    python bench_rutas.py                          # mide y compara con bench_baseline.json
+    python bench_rutas.py --tamanos pequena,mediana --repeticiones 10
+    python bench_rutas.py --actualizar-baseline    # guarda la medición como nueva línea base
+
+Cada tamaño se genera una vez con generar_datos.py (determinista) y se guarda en
+instance/bench/. La medición corre en un subproceso por tamaño, sobre una copia de la base
+(las rutas POST escriben), con la cache de respuestas apagada para medir las vistas.
+Por ruta se registran p50/p90/p99 de latencia, sentencias SQL por petición y el pico de
+memoria de una petición medido con tracemalloc en una pasada aparte.
+
+Una ruta tiene una regresión si ejecuta más sentencias que en la línea base, si su pico de
+memoria la supera en más de --tolerancia, o si su p50 la supera en más de
+--tolerancia-latencia; ambos con un piso absoluto para el ruido de las rutas rápidas. Las
+sentencias y la memoria son deterministas; la latencia no: en una VM compartida de un
+núcleo el p50 varió ±40 % entre corridas idénticas, de ahí la tolerancia amplia. Las
+latencias dependen de la máquina, así que la línea base debe regenerarse donde se compara.
+Sale con código 1 si hay regresiones.
+"""
+import argparse
+import gc
+import hashlib
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+BASE_DIR = os.path.abspath(os.path.dirname(__file__))
+BENCH_DIR = os.path.join(BASE_DIR, 'instance', 'bench')
+BASELINE = os.path.join(BASE_DIR, 'bench_baseline.json')
+
+# Argumentos de generar_datos.py por tamaño (todos cubren 2026)
+TAMANOS = {
+    'pequena': ['--anio-inicial', '2026', '--anios', '1', '--gastos-por-mes', '300'],
+    'mediana': ['--anio-inicial', '2024', '--anios', '3', '--gastos-por-mes', '3000'],
+    'grande': ['--anio-inicial', '2024', '--anios', '3', '--gastos-por-mes', '30000'],
+}
+
+# (nombre, método, url, datos del formulario)
+RUTAS = [
+    ('dashboard', 'GET', '/dashboard', None),
+    ('gastos_view', 'GET', '/gastos', None),
+    ('gastos_view_post', 'POST', '/gastos', {'concepto_id': '1', 'monto': '25000', 'fecha': '2026-06-15'}),
+    ('reporte_mes', 'GET', '/reporte_mes?year=2026&month=6', None),
+    ('reporte_mes_csv', 'GET', '/reporte_mes?year=2026&month=6&format=csv', None),
+    ('conceptos_view', 'GET', '/conceptos', None),
+    ('usuarios_view', 'GET', '/usuarios', None),
+    ('presupuestar_mes_siguiente', 'GET', '/presupuestar_mes_siguiente', None),
+    ('presupuestar_mes_siguiente_post', 'POST', '/presupuestar_mes_siguiente', {}),
+]
+
+CALENTAMIENTO = 2
+PISO_MS = 5.0
+PISO_KIB = 64.0
+
+
+def percentil(valores, p):
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, int(round(p / 100 * (len(ordenados) - 1))))]
+
+
+def esquema():
+    # Tablas, columnas e índices de los modelos, para no medir sobre una base de un esquema anterior
+    sys.path.insert(0, BASE_DIR)
+    from models import db
+    return ';'.join(
+        f'{t.name}({",".join(c.name for c in t.columns)})[{",".join(sorted(i.name for i in t.indexes))}]'
+        for t in db.metadata.sorted_tables
+    )
+
+
+def base_de_datos(tamano):
+    # Nombre con hash de los argumentos y del esquema: si cambian, se genera una base nueva
+    args = TAMANOS[tamano]
+    huella = hashlib.sha1((' '.join(args) + esquema()).encode()).hexdigest()[:8]
+    ruta = os.path.join(BENCH_DIR, f'{tamano}-{huella}.sqlite')
+    if not os.path.exists(ruta):
+        os.makedirs(BENCH_DIR, exist_ok=True)
+        print(f'Generando base {tamano}...', file=sys.stderr)
+        subprocess.run([sys.executable, os.path.join(BASE_DIR, 'generar_datos.py'), '--limpiar', *args],
+                       env={**os.environ, 'DATABASE_URL': 'sqlite:///' + ruta + '.tmp'},
+                       check=True, stdout=subprocess.DEVNULL)
+        os.replace(ruta + '.tmp', ruta)
+    return ruta
+
+
+def medir(ruta_db, repeticiones):
+    # Se ejecuta en el subproceso: la configuración se lee del entorno al importar app
+    os.environ['DATABASE_URL'] = 'sqlite:///' + ruta_db
+    os.environ['CACHE_RESPUESTAS'] = '0'
+    os.environ['CONSULTA_LENTA_MS'] = '0'
+    os.environ['METRICAS'] = '0'
+    sys.path.insert(0, BASE_DIR)
+    import logging
+    from app import app
+    from instrumentacion import contar_consultas
+
+    app.config.update(TESTING=True, WTF_CSRF_ENABLED=False)
+    app.logger.setLevel(logging.ERROR)
+    cliente = app.test_client()
+    r = cliente.post('/login', data={'email': 'usuario1@ejemplo.com', 'password': 'password'})
+    assert r.status_code == 302, 'no se pudo iniciar sesión en la base generada'
+
+    def pedir(metodo, url, datos):
+        r = cliente.open(url, method=metodo, data=datos)
+        r.get_data()
+        r.close()
+        assert r.status_code in (200, 302), f'{metodo} {url}: {r.status_code}'
+
+    resultados = {}
+    for nombre, metodo, url, datos in RUTAS:
+        for _ in range(CALENTAMIENTO):
+            pedir(metodo, url, datos)
+        tiempos = []
+        for _ in range(repeticiones):
+            gc.collect()  # que la basura de la ruta anterior no se cobre en esta
+            with contar_consultas() as estadisticas:
+                inicio = time.perf_counter()
+                pedir(metodo, url, datos)
+                tiempos.append((time.perf_counter() - inicio) * 1000)
+        tracemalloc.start()
+        pedir(metodo, url, datos)
+        pico = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        resultados[nombre] = {
+            'p50_ms': round(percentil(tiempos, 50), 2),
+            'p90_ms': round(percentil(tiempos, 90), 2),
+            'p99_ms': round(percentil(tiempos, 99), 2),
+            'consultas': estadisticas.cantidad,
+            'memoria_pico_kib': round(pico / 1024, 1),
+        }
+    return resultados
+
+
+def medir_en_subproceso(tamano, repeticiones):
+    original = base_de_datos(tamano)
+    fd, copia = tempfile.mkstemp(suffix='.sqlite')
+    os.close(fd)
+    try:
+        shutil.copyfile(original, copia)
+        salida = subprocess.run([sys.executable, __file__, '--medir', copia, '--repeticiones', str(repeticiones)],
+                                check=True, capture_output=True, text=True).stdout
+    finally:
+        os.remove(copia)
+    return json.loads(salida)
+
+
+def comparar(actual, base, tolerancia, tolerancia_latencia):
+    regresiones = []
+    for tamano, rutas in actual['resultados'].items():
+        for ruta, a in rutas.items():
+            b = base['resultados'].get(tamano, {}).get(ruta)
+            if b is None:
+                continue
+            if a['consultas'] > b['consultas']:
+                regresiones.append(f'{tamano}/{ruta}: {a["consultas"]} consultas (base {b["consultas"]})')
+            clave = 'p50_ms'
+            if a[clave] > b[clave] * (1 + tolerancia_latencia) and a[clave] - b[clave] > PISO_MS:
+                regresiones.append(f'{tamano}/{ruta}: {clave} {a[clave]} (base {b[clave]})')
+            clave = 'memoria_pico_kib'
+            if a[clave] > b[clave] * (1 + tolerancia) and a[clave] - b[clave] > PISO_KIB:
+                regresiones.append(f'{tamano}/{ruta}: {clave} {a[clave]} (base {b[clave]})')
+    return regresiones
+
+
+def imprimir(resultados):
+    for tamano, rutas in resultados.items():
+        print(f'\n{tamano}')
+        print(f'  {"ruta":34} {"p50 ms":>9} {"p90 ms":>9} {"p99 ms":>9} {"consultas":>10} {"pico KiB":>10}')
+        for ruta, r in rutas.items():
+            print(f'  {ruta:34} {r["p50_ms"]:9.2f} {r["p90_ms"]:9.2f} {r["p99_ms"]:9.2f} '
+                  f'{r["consultas"]:10d} {r["memoria_pico_kib"]:10.1f}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark de rutas con línea base.')
+    parser.add_argument('--tamanos', default='pequena,mediana', help=f'entre {", ".join(TAMANOS)}')
+    parser.add_argument('--repeticiones', type=int, default=20)
+    parser.add_argument('--tolerancia', type=float, default=0.2,
+                        help='aumento relativo permitido del pico de memoria (0.2 = 20 %%)')
+    parser.add_argument('--tolerancia-latencia', type=float, default=1.0,
+                        help='aumento relativo permitido del p50 (1.0 = el doble)')
+    parser.add_argument('--salida', default=os.path.join(BENCH_DIR, 'resultados.json'))
+    parser.add_argument('--baseline', default=BASELINE)
+    parser.add_argument('--actualizar-baseline', action='store_true')
+    parser.add_argument('--medir', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.medir:
+        json.dump(medir(args.medir, args.repeticiones), sys.stdout)
+        return 0
+
+    tamanos = [t.strip() for t in args.tamanos.split(',') if t.strip()]
+    desconocidos = [t for t in tamanos if t not in TAMANOS]
+    if desconocidos:
+        parser.error(f'tamaños desconocidos: {", ".join(desconocidos)}')
+
+    actual = {
+        'maquina': f'{platform.node()} {platform.machine()} Python {platform.python_version()}',
+        'repeticiones': args.repeticiones,
+        'resultados': {t: medir_en_subproceso(t, args.repeticiones) for t in tamanos},
+    }
+    imprimir(actual['resultados'])
+    os.makedirs(os.path.dirname(os.path.abspath(args.salida)), exist_ok=True)
+    with open(args.salida, 'w', encoding='utf-8') as f:
+        json.dump(actual, f, indent=2, ensure_ascii=False)
+
+    if args.actualizar_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(actual, f, indent=2, ensure_ascii=False)
+            f.write('\n')
+        print(f'\nLínea base actualizada en {args.baseline}')
+        return 0
+    if not os.path.exists(args.baseline):
+        print(f'\nNo existe {args.baseline}; use --actualizar-baseline para crearla')
+        return 0
+    with open(args.baseline, encoding='utf-8') as f:
+        base = json.load(f)
+    regresiones = comparar(actual, base, args.tolerancia, args.tolerancia_latencia)
+    if regresiones:
+        print('\nRegresiones respecto a la línea base:')
+        for r in regresiones:
+            print(f'  {r}')
+        return 1
+    print('\nSin regresiones respecto a la línea base')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
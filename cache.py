@@ -0,0 +1,143 @@
+from collections import OrderedDict
+from datetime import date
+from functools import wraps
+import threading
+import time
+
+from flask import request, session, make_response
+from werkzeug.http import is_resource_modified
+
+from models import db, MarcaCambios
+
+
+class CacheRespuestas:
+    # Cache LRU en memoria de respuestas GET, con clave (vista, argumentos, versión de datos,
+    # generación). La versión de datos es la marca 'datos' de marca_cambios, que avanza en la
+    # transacción de cada escritura de cualquier proceso (una búsqueda por clave primaria por
+    # petición); así un worker no sirve datos viejos después de que otro escribió. La
+    # generación es local: invalidar() la incrementa para liberar en el acto las entradas
+    # del proceso que escribió. CACHE_RESPUESTAS_TTL acota además la edad de una entrada.
+
+    def __init__(self, app=None):
+        self._datos = OrderedDict()
+        self._lock = threading.Lock()
+        self._bytes = 0
+        self.generacion = 0
+        self.aciertos = 0
+        self.fallos = 0
+        self.max_entradas = 128
+        self.max_bytes = 32 * 1024 * 1024
+        self.ttl = None
+        self.habilitado = True
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.habilitado = app.config.get('CACHE_RESPUESTAS', True)
+        self.max_entradas = app.config.get('CACHE_RESPUESTAS_MAX_ENTRADAS', self.max_entradas)
+        self.max_bytes = app.config.get('CACHE_RESPUESTAS_MAX_BYTES', self.max_bytes)
+        self.ttl = app.config.get('CACHE_RESPUESTAS_TTL', self.ttl)
+
+    def invalidar(self):
+        with self._lock:
+            self.generacion += 1
+            self._datos.clear()
+            self._bytes = 0
+
+    def obtener(self, clave):
+        with self._lock:
+            entrada = self._datos.get(clave)
+            if entrada is not None and self.ttl and time.monotonic() - entrada[0] > self.ttl:
+                self._quitar(clave)
+                entrada = None
+            if entrada is None:
+                self.fallos += 1
+                return None
+            self._datos.move_to_end(clave)
+            self.aciertos += 1
+            return entrada[1]
+
+    def guardar(self, clave, valor, tamano):
+        if tamano > self.max_bytes:
+            return
+        with self._lock:
+            if clave[-1] != self.generacion:
+                return  # los datos cambiaron mientras se construía la respuesta
+            if clave in self._datos:
+                self._quitar(clave)
+            self._datos[clave] = (time.monotonic(), valor, tamano)
+            self._bytes += tamano
+            while len(self._datos) > self.max_entradas or self._bytes > self.max_bytes:
+                self._quitar(next(iter(self._datos)))
+
+    def _quitar(self, clave):
+        _, _, tamano = self._datos.pop(clave)
+        self._bytes -= tamano
+
+    def estadisticas(self):
+        with self._lock:
+            return {
+                'entradas': len(self._datos),
+                'bytes': self._bytes,
+                'generacion': self.generacion,
+                'aciertos': self.aciertos,
+                'fallos': self.fallos,
+            }
+
+
+cache_respuestas = CacheRespuestas()
+
+
+def version_datos():
+    return db.session.scalar(db.select(MarcaCambios.version).where(MarcaCambios.clave == 'datos')) or 0
+
+
+def cache_respuesta(view):
+    # Decorador para vistas de solo lectura cuyo HTML no depende del usuario ni lleva token CSRF.
+    # No se usa la cache si hay mensajes flash pendientes (se mostrarían en la página guardada)
+    # ni para respuestas en streaming.
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if not cache_respuestas.habilitado or request.method != 'GET' or session.get('_flashes'):
+            return view(*args, **kwargs)
+        # La fecha forma parte de la clave porque las vistas usan el mes actual por defecto
+        clave = (request.endpoint, tuple(sorted(request.args.items(multi=True))), date.today(),
+                 version_datos(), cache_respuestas.generacion)
+        guardada = cache_respuestas.obtener(clave)
+        if guardada is not None:
+            body, status, headers = guardada
+            return make_response(body, status, headers)
+        response = make_response(view(*args, **kwargs))
+        if response.status_code == 200 and not response.is_streamed:
+            body = response.get_data()
+            headers = [(k, v) for k, v in response.headers.items() if k.lower() not in ('set-cookie', 'content-length')]
+            cache_respuestas.guardar(clave, (body, response.status_code, headers), len(body))
+        return response
+    return wrapper
+
+
+def respuesta_condicional(validador):
+    # GET condicional: validador() devuelve (etag, last_modified) a partir de marcas de
+    # modificación baratas de consultar. Si el cliente ya tiene esa versión se responde
+    # 304 sin ejecutar la vista.
+    def decorador(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if request.method != 'GET':
+                return view(*args, **kwargs)
+            etag, last_modified = validador()
+            if etag is None:
+                return view(*args, **kwargs)
+            if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+                response = make_response('', 304)
+            else:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            response.set_etag(etag)
+            if last_modified:
+                response.last_modified = last_modified
+            response.cache_control.no_cache = True  # revalidar siempre con el servidor
+            return response
+        return wrapper
+    return decorador
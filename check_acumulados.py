@@ -0,0 +1,112 @@
+"""Comprueba que gasto_mensual coincida con reconstruir_gasto_mensual() tras cada escritura.
+
+    python check_acumulados.py
+
+Corre sobre una base en memoria. Cada caso escribe gastos por el ORM (incluidos objetos
+cargados antes del último commit, que quedan expirados) y compara el acumulado mantenido
+por los eventos contra uno recalculado desde Gasto. Sale con código 1 si difieren.
+"""
+import os
+import sys
+from datetime import datetime
+
+os.environ['DATABASE_URL'] = 'sqlite://'
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
+
+from app import app
+from models import db, User, Area, Concepto, Gasto, GastoMensual, actualizar_esquema, reconstruir_gasto_mensual
+
+
+def acumulado():
+    filas = db.session.execute(
+        db.select(GastoMensual.concepto_id, GastoMensual.year, GastoMensual.month, GastoMensual.total,
+                  GastoMensual.cantidad)
+        .where(GastoMensual.cantidad != 0)
+        .order_by(GastoMensual.concepto_id, GastoMensual.year, GastoMensual.month)
+    ).all()
+    return [tuple(f) for f in filas]
+
+
+def nuevo_gasto(concepto, usuario, monto, fecha):
+    g = Gasto(concepto_id=concepto, usuario_id=usuario, monto=monto, fecha=fecha)
+    db.session.add(g)
+    db.session.commit()
+    return g
+
+
+def caso_expirado_cambia_mes_y_monto(c1, c2, u):
+    g = nuevo_gasto(c1, u, 30, datetime(2026, 6, 10))
+    g.monto = 50
+    g.fecha = datetime(2026, 7, 1)
+    db.session.commit()
+
+
+def caso_expirado_cambia_concepto(c1, c2, u):
+    g = nuevo_gasto(c1, u, 20, datetime(2026, 6, 10))
+    g.concepto_id = c2
+    db.session.commit()
+
+
+def caso_expirado_solo_monto(c1, c2, u):
+    g = nuevo_gasto(c2, u, 70, datetime(2026, 5, 3))
+    g.monto = 10
+    db.session.commit()
+
+
+def caso_sin_commit_intermedio(c1, c2, u):
+    g = Gasto(concepto_id=c1, usuario_id=u, monto=15, fecha=datetime(2026, 3, 1))
+    db.session.add(g)
+    db.session.flush()
+    g.fecha = datetime(2026, 4, 1)
+    db.session.commit()
+
+
+def caso_expirado_eliminado(c1, c2, u):
+    g = nuevo_gasto(c1, u, 40, datetime(2026, 8, 8))
+    db.session.delete(g)
+    db.session.commit()
+
+
+def caso_recargado_en_otra_sesion(c1, c2, u):
+    g_id = nuevo_gasto(c2, u, 90, datetime(2026, 9, 9)).id
+    db.session.remove()
+    g = db.session.get(Gasto, g_id)
+    g.fecha = datetime(2026, 10, 9)
+    g.monto = 95
+    db.session.commit()
+
+
+CASOS = [
+    caso_expirado_cambia_mes_y_monto,
+    caso_expirado_cambia_concepto,
+    caso_expirado_solo_monto,
+    caso_sin_commit_intermedio,
+    caso_expirado_eliminado,
+    caso_recargado_en_otra_sesion,
+]
+
+
+if __name__ == '__main__':
+    fallas = 0
+    with app.app_context():
+        actualizar_esquema()
+        area = Area(nombre='Hogar')
+        db.session.add(area)
+        db.session.flush()
+        c1 = Concepto(nombre='Agua', area_id=area.id, valor_presupuestado=100)
+        c2 = Concepto(nombre='Gas', area_id=area.id, valor_presupuestado=100)
+        u = User(name='Ana', email='ana@ejemplo.com', password='x', aporte=1.0)
+        db.session.add_all([c1, c2, u])
+        db.session.commit()
+        ids = (c1.id, c2.id, u.id)
+        for caso in CASOS:
+            caso(*ids)
+            mantenido = acumulado()
+            reconstruir_gasto_mensual()
+            esperado = acumulado()
+            ok = mantenido == esperado
+            fallas += not ok
+            print(f'{"ok   " if ok else "FALLA"} {caso.__name__}')
+            if not ok:
+                print(f'      mantenido: {mantenido}\n      esperado:  {esperado}')
+    sys.exit(1 if fallas else 0)
@@ -0,0 +1,105 @@
+"""Comprueba que las vistas de listado no disparen cargas perezosas de relaciones.
+
+    python check_cargas.py                                # sobre la base "pequena" de bench_rutas.py
+    python check_cargas.py --db instance/shared_budget.sqlite
+
+Cada ruta se pide sobre una copia de la base con la cache de respuestas apagada. Falla
+(código 1) si una plantilla o vista accede a una relación no cargada (p. ej. g.user en
+un listado sin joinedload) o si la ruta ejecuta más sentencias que su tope en RUTAS.
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+
+BASE_DIR = os.path.abspath(os.path.dirname(__file__))
+
+# (url, tope de sentencias SQL por petición, sin contar la carga del usuario de la sesión)
+RUTAS = [
+    # totales, últimos gastos + usuario + concepto, usuarios con lo pagado
+    ('/dashboard', 3),
+    # conceptos + área, usuarios del filtro, página de gastos + usuario + concepto
+    ('/gastos', 3),
+    # áreas del formulario, conceptos + área con totales
+    ('/conceptos', 2),
+    ('/areas', 1),
+    # usuarios, cantidad y total de gastos por usuario
+    ('/usuarios', 2),
+    # marca para el ETag, grupos con presupuesto y gastado, detalle + usuario, usuarios
+    ('/reporte_mes?year=2026&month=6', 4),
+    # lo mismo sin el detalle
+    ('/reporte_mes?year=2026&month=6&format=csv', 3),
+    ('/presupuestar_mes_siguiente', 1),
+]
+
+
+def revisar(ruta_db):
+    os.environ['DATABASE_URL'] = 'sqlite:///' + ruta_db
+    os.environ['CACHE_RESPUESTAS'] = '0'
+    os.environ['CONSULTA_LENTA_MS'] = '0'
+    sys.path.insert(0, BASE_DIR)
+    import logging
+    from sqlalchemy import event
+    from app import app
+    from models import db, User
+    from instrumentacion import assert_max_consultas
+
+    app.config.update(TESTING=True, WTF_CSRF_ENABLED=False)
+    app.logger.setLevel(logging.ERROR)
+    cargas = []
+
+    def registrar_carga(estado):
+        # lazy_loaded_from solo se llena en cargas perezosas, no en joinedload/selectinload
+        if estado.lazy_loaded_from is not None:
+            origen = type(estado.lazy_loaded_from.obj()).__name__
+            cargas.append(f'{origen} -> {" ".join(str(estado.statement).split())[:120]}')
+
+    event.listen(db.session, 'do_orm_execute', registrar_carga)
+    cliente = app.test_client()
+    with app.app_context():
+        email = db.session.scalar(db.select(User.email).order_by(User.id))
+    r = cliente.post('/login', data={'email': email, 'password': 'password'})
+    if r.status_code != 302:
+        raise SystemExit(f'No se pudo iniciar sesión como {email} (la contraseña debe ser "password")')
+
+    fallas = []
+    for url, tope in RUTAS:
+        cargas.clear()
+        try:
+            # tope + 1: la primera sentencia es la carga del usuario de la sesión (user_loader)
+            r = assert_max_consultas(cliente, url, tope + 1)
+            estado = r.status_code
+            r.close()
+        except AssertionError as exc:
+            estado = None
+            fallas.append(f'{url}: {exc}')
+        print(f'{url:45} {estado or "---"}  tope {tope} sentencias  {len(cargas)} cargas perezosas')
+        if estado not in (None, 200):
+            fallas.append(f'{url}: estado {estado}')
+        fallas.extend(f'{url}: carga perezosa desde {c}' for c in cargas)
+    return fallas
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Detecta cargas perezosas en las vistas de listado.')
+    parser.add_argument('--db', help='base a copiar (por defecto la base "pequena" de bench_rutas.py)')
+    args = parser.parse_args()
+    if args.db:
+        original = args.db
+    else:
+        from bench_rutas import base_de_datos
+        original = base_de_datos('pequena')
+    directorio = tempfile.mkdtemp(prefix='cargas-')
+    try:
+        copia = os.path.join(directorio, 'cargas.sqlite')
+        shutil.copyfile(original, copia)
+        fallas = revisar(copia)
+    finally:
+        shutil.rmtree(directorio, ignore_errors=True)
+    if fallas:
+        print('\nFallas:')
+        for f in fallas:
+            print(f'  {f}')
+        sys.exit(1)
+    print('\nSin cargas perezosas')
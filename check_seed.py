@@ -1,5 +1,5 @@
 from app import app
-from models import db, Concepto, PresupuestoMensual, Gasto
+from models import db, Concepto, PresupuestoMensual, GastoMensual
 from datetime import date
 
 if __name__ == '__main__':
@@ -17,5 +17,6 @@ if __name__ == '__main__':
                 continue
             for m in (8,9,10):
                 pm = PresupuestoMensual.query.filter_by(concepto_id=c.id, year=2025, month=m).first()
-                gastado = sum(g.monto for g in c.gastos if g.fecha.year==2025 and g.fecha.month==m)
+                gm = db.session.get(GastoMensual, (c.id, 2025, m))
+                gastado = gm.total if gm else 0
                 print(f"{nombre} 2025-{m:02d}: pres={(pm.valor_presupuestado if pm else None)} gastado={gastado}")
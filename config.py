@@ -1,9 +1,89 @@
 import os
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import StaticPool
 BASE_DIR = os.path.abspath(os.path.dirname(__file__))
 
 
+def opciones_motor(uri):
+    # SQLALCHEMY_ENGINE_OPTIONS según el tipo de base, ajustables con variables DB_*.
+    # El pool debe dimensionarse por trabajador: cada hilo retiene una conexión mientras
+    # atiende una petición, así que DB_POOL_SIZE + DB_MAX_OVERFLOW debería cubrir los hilos
+    # de cada proceso (ver las métricas presupuesto_db_* en /metrics).
+    url = make_url(uri)
+    if url.get_backend_name() == 'sqlite':
+        if url.database in (None, '', ':memory:'):
+            # Pruebas: una sola conexión compartida, o cada conexión vería una base vacía
+            return {'poolclass': StaticPool, 'connect_args': {'check_same_thread': False}}
+        # Archivo local: sin pre-ping ni reciclado (no hay servidor que corte conexiones);
+        # la espera por bloqueos la maneja busy_timeout (ver basedatos.py)
+        return {
+            'pool_size': int(os.environ.get('DB_POOL_SIZE', 5)),
+            'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 10)),
+            'pool_timeout': float(os.environ.get('DB_POOL_TIMEOUT', 30)),
+            'pool_pre_ping': os.environ.get('DB_POOL_PRE_PING', '0') == '1',
+        }
+    opciones = {
+        'pool_size': int(os.environ.get('DB_POOL_SIZE', 5)),
+        'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 10)),
+        'pool_timeout': float(os.environ.get('DB_POOL_TIMEOUT', 30)),
+        'pool_pre_ping': os.environ.get('DB_POOL_PRE_PING', '1') == '1',
+        # Por debajo del corte por inactividad habitual de servidores y balanceadores
+        'pool_recycle': int(os.environ.get('DB_POOL_RECYCLE', 1800)),
+    }
+    timeout_ms = int(os.environ.get('DB_STATEMENT_TIMEOUT_MS', 30000))
+    if timeout_ms:
+        if url.get_backend_name() == 'postgresql':
+            opciones['connect_args'] = {'options': f'-c statement_timeout={timeout_ms}'}
+        elif url.get_backend_name() in ('mysql', 'mariadb'):
+            opciones['connect_args'] = {'init_command': f'SET SESSION max_execution_time={timeout_ms}'}
+    return opciones
+
+
 class Config:
     SECRET_KEY = os.environ.get('SECRET_KEY', 'dev-secret-key')
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or \
     'sqlite:///' + os.path.join(BASE_DIR, 'instance', 'shared_budget.sqlite')
-    SQLALCHEMY_TRACK_MODIFICATIONS = False
\ No newline at end of file
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+    SQLALCHEMY_ENGINE_OPTIONS = opciones_motor(SQLALCHEMY_DATABASE_URI)
+    # Aplica actualizar_esquema() al importar app.py (tablas, columnas e índices que falten).
+    # Con varios procesos conviene apagarlo y correr `flask actualizar-esquema` al desplegar.
+    ACTUALIZAR_ESQUEMA = os.environ.get('ACTUALIZAR_ESQUEMA', '1') == '1'
+    GASTOS_POR_PAGINA = int(os.environ.get('GASTOS_POR_PAGINA', 50))
+    # Meses máximos de una exportación CSV por rango (from=...&to=...)
+    REPORTE_MAX_MESES = int(os.environ.get('REPORTE_MAX_MESES', 120))
+    # Cache de respuestas de dashboard y reportes (ver cache.py)
+    CACHE_RESPUESTAS = os.environ.get('CACHE_RESPUESTAS', '1') == '1'
+    CACHE_RESPUESTAS_MAX_ENTRADAS = int(os.environ.get('CACHE_RESPUESTAS_MAX_ENTRADAS', 128))
+    CACHE_RESPUESTAS_MAX_BYTES = int(os.environ.get('CACHE_RESPUESTAS_MAX_BYTES', 32 * 1024 * 1024))
+    CACHE_RESPUESTAS_TTL = float(os.environ['CACHE_RESPUESTAS_TTL']) if os.environ.get('CACHE_RESPUESTAS_TTL') else None
+    # Conteo de consultas SQL por petición y detector de N+1 (ver instrumentacion.py)
+    INSTRUMENTACION_SQL = os.environ.get('INSTRUMENTACION_SQL', '1') == '1'
+    N_MAS_1_UMBRAL = int(os.environ.get('N_MAS_1_UMBRAL', 5))
+    SERVER_TIMING = os.environ.get('SERVER_TIMING', '1') == '1'
+    # /metrics en formato Prometheus (ver metricas.py); por defecto solo responde a localhost
+    METRICAS = os.environ.get('METRICAS', '1') == '1'
+    METRICAS_PERMITIR_REMOTO = os.environ.get('METRICAS_PERMITIR_REMOTO', '0') == '1'
+    # Sentencias más lentas que esto (ms) se registran con su EXPLAIN QUERY PLAN; 0 lo desactiva
+    CONSULTA_LENTA_MS = float(os.environ.get('CONSULTA_LENTA_MS', 100))
+    # Perfilado bajo demanda con ?_profile=1 para usuarios autenticados (ver perfilador.py)
+    PERFILADOR = os.environ.get('PERFILADOR', '0') == '1'
+    PERFILES_DIR = os.environ.get('PERFILES_DIR') or os.path.join(BASE_DIR, 'instance', 'perfiles')
+    # Muestreo continuo de pilas de todos los hilos, en archivos .folded por hora
+    MUESTREO_CONTINUO = os.environ.get('MUESTREO_CONTINUO', '0') == '1'
+    MUESTREO_HZ = int(os.environ.get('MUESTREO_HZ', 100))
+    MUESTREO_DIR = os.environ.get('MUESTREO_DIR') or os.path.join(BASE_DIR, 'instance', 'perfiles', 'continuo')
+    # Snapshots de tracemalloc por petición, solo para depuración (ver perfilador.py)
+    MEMORIA_TRACEMALLOC = os.environ.get('MEMORIA_TRACEMALLOC', '0') == '1'
+    MEMORIA_TOP = int(os.environ.get('MEMORIA_TOP', 10))
+    MEMORIA_MARCOS = int(os.environ.get('MEMORIA_MARCOS', 1))
+    # Pragmas aplicados a cada conexión SQLite nueva (ver basedatos.py); SQLITE_PRAGMAS=0 los desactiva
+    SQLITE_PRAGMAS = os.environ.get('SQLITE_PRAGMAS', '1') == '1'
+    SQLITE_JOURNAL_MODE = os.environ.get('SQLITE_JOURNAL_MODE', 'WAL')
+    SQLITE_SYNCHRONOUS = os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL')
+    SQLITE_MMAP_SIZE = int(os.environ.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024))
+    SQLITE_CACHE_SIZE = int(os.environ.get('SQLITE_CACHE_SIZE', -64000))  # negativo = KiB
+    SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 5000))
+    SQLITE_TEMP_STORE = os.environ.get('SQLITE_TEMP_STORE', 'MEMORY')
+    # Reintentos de las escrituras de las vistas cuando SQLite sigue bloqueada tras busy_timeout
+    ESCRITURA_REINTENTOS = int(os.environ.get('ESCRITURA_REINTENTOS', 5))
+    ESCRITURA_ESPERA = float(os.environ.get('ESCRITURA_ESPERA', 0.05))
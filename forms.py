@@ -1,6 +1,7 @@
 from flask_wtf import FlaskForm
+from flask_wtf.file import FileField, FileRequired, FileAllowed
 from wtforms import StringField, PasswordField, SubmitField, FloatField, SelectField, IntegerField, DateField
-from wtforms.validators import DataRequired, Email, NumberRange
+from wtforms.validators import DataRequired, Email, NumberRange, Optional
 
 
 class LoginForm(FlaskForm):
@@ -33,4 +34,23 @@ class GastoForm(FlaskForm):
     concepto_id = SelectField('Concepto', coerce=int)
     monto = FloatField('Monto', validators=[DataRequired()])
     fecha = DateField('Fecha', validators=[DataRequired()], format='%Y-%m-%d')
-    submit = SubmitField('Registrar gasto')
\ No newline at end of file
+    submit = SubmitField('Registrar gasto')
+
+
+class ImportarGastosForm(FlaskForm):
+    archivo = FileField('Archivo CSV', validators=[FileRequired(), FileAllowed(['csv', 'txt'], 'Solo archivos CSV')])
+    submit = SubmitField('Importar gastos')
+
+
+class FiltroGastosForm(FlaskForm):
+    # Filtros del historial de gastos; viajan por querystring (GET), sin CSRF
+    class Meta:
+        csrf = False
+
+    concepto_id = SelectField('Concepto', coerce=int, validators=[Optional()])
+    usuario_id = SelectField('Usuario', coerce=int, validators=[Optional()])
+    desde = DateField('Desde', validators=[Optional()], format='%Y-%m-%d')
+    hasta = DateField('Hasta', validators=[Optional()], format='%Y-%m-%d')
+    monto_min = FloatField('Monto mínimo', validators=[Optional()])
+    monto_max = FloatField('Monto máximo', validators=[Optional()])
+    submit = SubmitField('Filtrar')
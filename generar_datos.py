@@ -0,0 +1,222 @@
+"""Genera datos sintéticos a escala de producción para pruebas de carga.
+
+Ejemplos:
+    python generar_datos.py --limpiar
+    python generar_datos.py --limpiar --anios 10 --gastos-por-mes 83334   # ~10 millones de gastos
+
+El resultado es determinista para una misma --semilla y los mismos parámetros. Los gastos se
+insertan con executemany de Core por lotes (sin pasar por los eventos del ORM) y al final se
+reconstruye el acumulado gasto_mensual.
+"""
+import argparse
+import math
+import os
+import random
+import time
+import unicodedata
+from datetime import datetime
+
+# Cada lote de inserción superaría el umbral de consultas lentas
+os.environ.setdefault('CONSULTA_LENTA_MS', '0')
+
+from app import app
+from models import db, User, Area, Concepto, Gasto, PresupuestoMensual, GastoMensual, MarcaCambios, \
+    actualizar_esquema, guardar_presupuestos_mensuales, reconstruir_gasto_mensual
+
+
+AREAS = ['Servicios', 'Hogar', 'Alimentación', 'Transporte', 'Salud', 'Educación', 'Ocio', 'Finanzas',
+         'Mascotas', 'Ropa', 'Tecnología', 'Regalos']
+
+# (nombre, monto mediano mensual)
+CONCEPTOS = [
+    ('Agua', 110000), ('Energía', 140000), ('Gas', 16000), ('Internet', 90000), ('Administración', 290000),
+    ('Mercado', 45000), ('Plaza', 25000), ('Panadería', 8000), ('Restaurantes', 60000), ('Domicilios', 35000),
+    ('Gasolina', 80000), ('Peajes', 12000), ('Taxi', 18000), ('Parqueadero', 9000), ('Mantenimiento carro', 250000),
+    ('Farmacia', 30000), ('Medicina prepagada', 320000), ('Odontología', 150000), ('Gimnasio', 120000),
+    ('Colegiatura', 850000), ('Útiles escolares', 70000), ('Cursos', 200000), ('Cine', 40000),
+    ('Streaming', 35000), ('Viajes', 900000), ('Seguro hogar', 95000), ('Impuesto predial', 600000),
+    ('Cuota crédito', 1200000), ('Comida mascotas', 90000), ('Veterinario', 110000), ('Ropa', 150000),
+    ('Calzado', 180000), ('Celular', 60000), ('Computador', 2500000), ('Cumpleaños', 120000),
+    ('Navidad', 400000), ('Aseo', 50000), ('Jardinería', 70000), ('Reparaciones', 160000), ('Donaciones', 50000),
+]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Genera datos sintéticos deterministas.')
+    parser.add_argument('--semilla', type=int, default=42)
+    parser.add_argument('--usuarios', type=int, default=4)
+    parser.add_argument('--areas', type=int, default=8)
+    parser.add_argument('--conceptos', type=int, default=60)
+    parser.add_argument('--anio-inicial', type=int, default=2023)
+    parser.add_argument('--anios', type=int, default=3)
+    parser.add_argument('--gastos-por-mes', type=int, default=300)
+    parser.add_argument('--duplicados', type=float, default=0.15,
+                        help='fracción de conceptos que repiten otro nombre con variaciones de forma')
+    parser.add_argument('--presupuestos', type=float, default=0.3,
+                        help='fracción de (concepto, mes) con presupuesto mensual propio')
+    parser.add_argument('--lote', type=int, default=20000)
+    parser.add_argument('--limpiar', action='store_true', help='borra todos los datos antes de generar')
+    return parser.parse_args()
+
+
+def quitar_acentos(texto):
+    return ''.join(ch for ch in unicodedata.normalize('NFD', texto) if unicodedata.category(ch) != 'Mn')
+
+
+def variante_nombre(rng, nombre):
+    # Mismo nombre normalizado que el original: cambia mayúsculas, acentos o espacios
+    opciones = [
+        lambda n: n.lower(),
+        lambda n: n.upper(),
+        lambda n: quitar_acentos(n),
+        lambda n: f'  {n} ',
+        lambda n: n.replace(' ', '  '),
+        lambda n: quitar_acentos(n).lower() + ' ',
+    ]
+    nueva = rng.choice(opciones)(nombre)
+    return nueva if nueva != nombre else f' {nombre}'
+
+
+def limpiar():
+    for model in (GastoMensual, Gasto, PresupuestoMensual, Concepto, Area, MarcaCambios, User):
+        db.session.execute(model.__table__.delete())
+    db.session.commit()
+
+
+def crear_usuarios(rng, cantidad):
+    # Los números siguen a los usuarios existentes para no repetir correos sin --limpiar
+    existentes = db.session.scalar(db.select(db.func.count(User.id)))
+    pesos = [rng.uniform(1, 3) for _ in range(cantidad)]
+    total = sum(pesos)
+    usuarios = [
+        User(name=f'Usuario {n}', email=f'usuario{n}@ejemplo.com', password='password', aporte=round(p / total, 4))
+        for n, p in enumerate(pesos, start=existentes + 1)
+    ]
+    db.session.add_all(usuarios)
+    db.session.flush()
+    # (id, aporte): valores planos para no recargar los objetos expirados tras el commit
+    datos = [(u.id, u.aporte) for u in usuarios]
+    db.session.commit()
+    return datos
+
+
+def crear_catalogo(rng, n_areas, n_conceptos, duplicados):
+    areas = [Area(nombre=AREAS[i] if i < len(AREAS) else f'Área {i + 1}') for i in range(n_areas)]
+    db.session.add_all(areas)
+    db.session.flush()
+
+    conceptos = []   # (Concepto, monto mediano)
+    for i in range(n_conceptos):
+        if conceptos and rng.random() < duplicados:
+            original, mediana = rng.choice(conceptos)
+            nombre = variante_nombre(rng, original.nombre.strip())
+        elif i < len(CONCEPTOS):
+            nombre, mediana = CONCEPTOS[i]
+        else:
+            base, mediana = CONCEPTOS[i % len(CONCEPTOS)]
+            nombre = f'{base} {i // len(CONCEPTOS) + 1}'
+        concepto = Concepto(nombre=nombre, area_id=rng.choice(areas).id,
+                            valor_presupuestado=round(mediana * rng.uniform(0.9, 1.4), -2))
+        conceptos.append((concepto, mediana))
+    db.session.add_all(c for c, _ in conceptos)
+    db.session.flush()
+    datos = [(c.id, c.valor_presupuestado, mediana) for c, mediana in conceptos]
+    db.session.commit()
+    return datos
+
+
+def meses(anio_inicial, anios):
+    for year in range(anio_inicial, anio_inicial + anios):
+        for month in range(1, 13):
+            yield year, month
+
+
+def dias_del_mes(year, month):
+    siguiente = datetime(year + 1, 1, 1) if month == 12 else datetime(year, month + 1, 1)
+    return (siguiente - datetime(year, month, 1)).days
+
+
+def generar_presupuestos(rng, conceptos, args):
+    for year, month in meses(args.anio_inicial, args.anios):
+        valores = {
+            concepto_id: round(valor * rng.uniform(0.8, 1.3), -2)
+            for concepto_id, valor, _ in conceptos if rng.random() < args.presupuestos
+        }
+        guardar_presupuestos_mensuales(year, month, valores)
+    db.session.commit()
+
+
+def generar_gastos(rng, conceptos, usuarios, args):
+    # Popularidad tipo Zipf: pocos conceptos concentran la mayoría de los gastos.
+    # Montos lognormales alrededor de la mediana de cada concepto, repartida entre sus gastos.
+    orden = list(range(len(conceptos)))
+    rng.shuffle(orden)
+    pesos = [0.0] * len(conceptos)
+    for rango, i in enumerate(orden, start=1):
+        pesos[i] = 1 / rango ** 1.1
+    total_pesos = sum(pesos)
+    acumulado = 0.0
+    cum_conceptos = []
+    for p in pesos:
+        acumulado += p
+        cum_conceptos.append(acumulado)
+    gastos_esperados = [args.gastos_por_mes * p / total_pesos for p in pesos]
+    mu = [math.log(max(mediana / max(esperados, 1), 500)) for (_, _, mediana), esperados in zip(conceptos, gastos_esperados)]
+    ids = [concepto_id for concepto_id, _, _ in conceptos]
+
+    usuario_ids = [usuario_id for usuario_id, _ in usuarios]
+    cum_usuarios = []
+    acumulado = 0.0
+    for _, aporte in usuarios:
+        acumulado += aporte
+        cum_usuarios.append(acumulado)
+
+    insert = Gasto.__table__.insert()
+    total = 0
+    inicio = time.perf_counter()
+    lote = []
+    for year, month in meses(args.anio_inicial, args.anios):
+        n = args.gastos_por_mes
+        dias = dias_del_mes(year, month)
+        indices = rng.choices(range(len(ids)), cum_weights=cum_conceptos, k=n)
+        quienes = rng.choices(usuario_ids, cum_weights=cum_usuarios, k=n)
+        for i, usuario_id in zip(indices, quienes):
+            lote.append({
+                'concepto_id': ids[i],
+                'usuario_id': usuario_id,
+                'monto': round(rng.lognormvariate(mu[i], 0.6), -2) or 100.0,
+                'fecha': datetime(year, month, rng.randint(1, dias), rng.randint(7, 22), rng.randint(0, 59)),
+            })
+            if len(lote) >= args.lote:
+                db.session.execute(insert, lote)
+                db.session.commit()
+                total += len(lote)
+                lote = []
+        print(f'{year}-{month:02d}: {total + len(lote)} gastos ({time.perf_counter() - inicio:.0f} s)')
+    if lote:
+        db.session.execute(insert, lote)
+        db.session.commit()
+        total += len(lote)
+    return total
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    rng = random.Random(args.semilla)
+    with app.app_context():
+        actualizar_esquema()
+        if args.limpiar:
+            limpiar()
+        if db.engine.dialect.name == 'sqlite':
+            # Carga masiva: sin fsync por transacción (una caída a mitad obliga a regenerar)
+            db.session.execute(db.text('PRAGMA synchronous = OFF'))
+        inicio = time.perf_counter()
+        usuarios = crear_usuarios(rng, args.usuarios)
+        conceptos = crear_catalogo(rng, args.areas, args.conceptos, args.duplicados)
+        generar_presupuestos(rng, conceptos, args)
+        total = generar_gastos(rng, conceptos, usuarios, args)
+        print('Reconstruyendo gasto_mensual...')
+        reconstruir_gasto_mensual()
+        db.session.commit()
+        print(f'{len(usuarios)} usuarios, {len(conceptos)} conceptos, {total} gastos en '
+              f'{time.perf_counter() - inicio:.0f} s')
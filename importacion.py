@@ -0,0 +1,207 @@
+from datetime import datetime
+import csv
+import io
+import math
+
+from models import db, User, Concepto, Gasto, PresupuestoMensual, GastoMensual, aplicar_deltas_gasto_mensual, \
+    normalizar_nombre
+
+
+COLUMNAS = ('concepto', 'usuario', 'monto', 'fecha')
+FORMATOS_FECHA = ('%Y-%m-%d', '%d/%m/%Y')
+MAX_ERRORES = 200
+# Se prueban en orden; las exportaciones de bancos y de Excel suelen venir en Windows-1252
+CODIFICACIONES = ('utf-8-sig', 'cp1252')
+
+
+class ResultadoImportacion:
+    def __init__(self):
+        self.insertados = 0
+        self.errores = []        # (número de fila, mensaje)
+        self.total_errores = 0
+        self.advertencias = []
+
+    def error(self, fila, mensaje):
+        self.total_errores += 1
+        if len(self.errores) < MAX_ERRORES:
+            self.errores.append((fila, mensaje))
+
+
+class ImportacionInvalida(Exception):
+    # El archivo tiene errores: quien llamó debe deshacer la transacción (puede haber lotes
+    # ya insertados) y mostrar resultado.errores
+    def __init__(self, resultado):
+        super().__init__(f'{resultado.total_errores} error(es) en el archivo')
+        self.resultado = resultado
+
+
+def _mapa_conceptos():
+    # id -> (nombre, valor_presupuestado); clave normalizada -> [ids]
+    por_id = {}
+    por_nombre = {}
+    filas = db.session.execute(
+        db.select(Concepto.id, Concepto.nombre, Concepto.valor_presupuestado, Concepto.nombre_normalizado)
+    )
+    for c_id, nombre, valor, clave in filas:
+        por_id[c_id] = (nombre, valor)
+        por_nombre.setdefault(clave, []).append(c_id)
+    return por_id, por_nombre
+
+
+def _mapa_usuarios():
+    por_id = set()
+    por_texto = {}
+    for u_id, name, email in db.session.execute(db.select(User.id, User.name, User.email)):
+        por_id.add(u_id)
+        por_texto.setdefault(email.strip().lower(), []).append(u_id)
+        por_texto.setdefault(name.strip().lower(), []).append(u_id)
+    return por_id, por_texto
+
+
+def _resolver(valor, por_id, por_texto, clave):
+    valor = (valor or '').strip()
+    if valor.isdigit() and int(valor) in por_id:
+        return int(valor), None
+    ids = por_texto.get(clave(valor), [])
+    if len(ids) == 1:
+        return ids[0], None
+    if len(ids) > 1:
+        return None, f'"{valor}" es ambiguo ({len(ids)} coincidencias)'
+    return None, f'"{valor}" no existe'
+
+
+def _parse_fecha(valor):
+    for fmt in FORMATOS_FECHA:
+        try:
+            return datetime.strptime(valor.strip(), fmt)
+        except ValueError:
+            continue
+    return None
+
+
+def _lector_csv(stream):
+    # None si el archivo no se puede decodificar con ninguna de CODIFICACIONES
+    datos = stream.read()
+    for codificacion in CODIFICACIONES:
+        try:
+            texto = datos.decode(codificacion)
+            break
+        except UnicodeDecodeError:
+            continue
+    else:
+        return None
+    try:
+        dialecto = csv.Sniffer().sniff(texto[:4096], delimiters=',;\t')
+    except csv.Error:
+        dialecto = csv.excel
+    return csv.reader(io.StringIO(texto, newline=''), dialecto)
+
+
+def importar_gastos_csv(stream, usuario_por_defecto_id, tamano_lote=500):
+    # Importa gastos desde un CSV con encabezado concepto,usuario,monto,fecha.
+    # No confirma la transacción: se llama desde reintentar_escritura, que hace el commit
+    # junto con la marca 'datos'. Si alguna fila tiene errores lanza ImportacionInvalida
+    # y quien llamó deshace todo. Las inserciones son executemany de Core, que no pasan por
+    # los eventos de Gasto, así que el acumulado mensual se actualiza al final con los
+    # deltas del lote.
+    resultado = ResultadoImportacion()
+    lector = _lector_csv(stream)
+    if lector is None:
+        resultado.error(1, 'No se pudo leer el archivo: guárdelo como CSV en UTF-8 o Windows-1252')
+        raise ImportacionInvalida(resultado)
+    encabezado = [h.strip().lower() for h in next(lector, [])]
+    faltantes = [c for c in COLUMNAS if c not in encabezado and c != 'usuario']
+    if faltantes:
+        resultado.error(1, f'Faltan columnas en el encabezado: {", ".join(faltantes)}')
+        raise ImportacionInvalida(resultado)
+    pos = {c: encabezado.index(c) for c in COLUMNAS if c in encabezado}
+
+    conceptos_por_id, conceptos_por_nombre = _mapa_conceptos()
+    usuarios_por_id, usuarios_por_texto = _mapa_usuarios()
+
+    deltas = {}   # (concepto_id, year, month) -> (monto, cantidad)
+    lote = []
+    for numero, fila in enumerate(lector, start=2):
+        if not any(v.strip() for v in fila):
+            continue
+        valores = {c: (fila[i] if i < len(fila) else '') for c, i in pos.items()}
+
+        concepto_id, err = _resolver(valores['concepto'], conceptos_por_id, conceptos_por_nombre,
+                                     lambda v: normalizar_nombre(v)[0])
+        if err:
+            resultado.error(numero, f'Concepto {err}')
+        if valores.get('usuario', '').strip():
+            usuario_id, err_u = _resolver(valores['usuario'], usuarios_por_id, usuarios_por_texto,
+                                          lambda v: v.strip().lower())
+            if err_u:
+                resultado.error(numero, f'Usuario {err_u}')
+        else:
+            usuario_id = usuario_por_defecto_id
+        try:
+            monto = float(valores['monto'].strip())
+        except ValueError:
+            monto = None
+        # float() acepta 'inf', 'nan' y '1e309', que romperían el acumulado mensual
+        if monto is None or not math.isfinite(monto) or monto <= 0:
+            resultado.error(numero, f'Monto inválido: "{valores["monto"]}"')
+        fecha = _parse_fecha(valores['fecha'])
+        if fecha is None:
+            resultado.error(numero, f'Fecha inválida: "{valores["fecha"]}" (use AAAA-MM-DD o DD/MM/AAAA)')
+
+        if resultado.total_errores:
+            # Se siguen validando las filas restantes, pero ya no se inserta nada
+            continue
+        lote.append({'concepto_id': concepto_id, 'usuario_id': usuario_id, 'monto': monto, 'fecha': fecha})
+        key = (concepto_id, fecha.year, fecha.month)
+        total, cantidad = deltas.get(key, (0.0, 0))
+        deltas[key] = (total + monto, cantidad + 1)
+        if len(lote) >= tamano_lote:
+            db.session.execute(Gasto.__table__.insert(), lote)
+            resultado.insertados += len(lote)
+            lote = []
+
+    if resultado.total_errores:
+        resultado.insertados = 0
+        raise ImportacionInvalida(resultado)
+    if lote:
+        db.session.execute(Gasto.__table__.insert(), lote)
+        resultado.insertados += len(lote)
+
+    # Las advertencias se calculan antes de aplicar los deltas, con el acumulado previo
+    resultado.advertencias = _advertencias_presupuesto(deltas, conceptos_por_id)
+    aplicar_deltas_gasto_mensual(db.session.connection(), deltas)
+    return resultado
+
+
+def _advertencias_presupuesto(deltas, conceptos_por_id):
+    # Misma regla que gastos_view, pero por (concepto, mes) y con dos consultas en total
+    if not deltas:
+        return []
+    claves = list(deltas)
+    presupuestos = dict(
+        ((c_id, y, m), valor) for c_id, y, m, valor in db.session.execute(
+            db.select(PresupuestoMensual.concepto_id, PresupuestoMensual.year, PresupuestoMensual.month,
+                      PresupuestoMensual.valor_presupuestado)
+            .where(db.tuple_(PresupuestoMensual.concepto_id, PresupuestoMensual.year, PresupuestoMensual.month).in_(claves))
+        )
+    )
+    gastado = dict(
+        ((c_id, y, m), total) for c_id, y, m, total in db.session.execute(
+            db.select(GastoMensual.concepto_id, GastoMensual.year, GastoMensual.month, GastoMensual.total)
+            .where(db.tuple_(GastoMensual.concepto_id, GastoMensual.year, GastoMensual.month).in_(claves))
+        )
+    )
+    advertencias = []
+    for key in sorted(claves):
+        concepto_id, year, month = key
+        nombre, valor_base = conceptos_por_id[concepto_id]
+        presupuesto_mes = presupuestos.get(key, valor_base) or 0
+        disponible = presupuesto_mes - gastado.get(key, 0)
+        importado = deltas[key][0]
+        if importado > max(disponible, 0):
+            exceso = importado - max(disponible, 0)
+            advertencias.append(
+                f'Advertencia: los gastos importados exceden el presupuesto disponible para {nombre} '
+                f'en {month}/{year} por ${exceso:,.0f}. Se registrarán de todas formas.'
+            )
+    return advertencias
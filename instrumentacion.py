@@ -0,0 +1,272 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+import queue
+import threading
+import time
+
+from flask import current_app, g, has_request_context, request, before_render_template, template_rendered
+from sqlalchemy import event
+from sqlalchemy.pool import StaticPool
+
+from models import db
+
+
+class EstadisticasConsultas:
+    # Sentencias SQL ejecutadas durante una petición (o dentro de contar_consultas())
+    MAX_PARAMETROS = 50
+
+    def __init__(self):
+        self.inicio = time.perf_counter()
+        self.cantidad = 0
+        self.tiempo = 0.0
+        self.sentencias = {}   # sql -> [veces, {repr(parámetros)}]
+        self.tiempo_plantillas = 0.0
+        self._plantilla = None  # (inicio, tiempo de BD al empezar a renderizar)
+
+    def registrar(self, statement, parameters, duracion):
+        self.cantidad += 1
+        self.tiempo += duracion
+        entrada = self.sentencias.get(statement)
+        if entrada is None:
+            entrada = self.sentencias[statement] = [0, set()]
+        entrada[0] += 1
+        if len(entrada[1]) < self.MAX_PARAMETROS:
+            entrada[1].add(repr(parameters))
+
+    def sospechas_n_mas_1(self, umbral):
+        # La misma sentencia repetida con parámetros distintos suele ser una carga perezosa en un bucle
+        return [
+            (statement, veces)
+            for statement, (veces, parametros) in self.sentencias.items()
+            if veces >= umbral and len(parametros) > 1
+        ]
+
+
+class RegistroConsultasLentas:
+    # Registra en el log las sentencias que tardan más de CONSULTA_LENTA_MS, con sus parámetros,
+    # la ruta que las ejecutó y el EXPLAIN QUERY PLAN de SQLite. El plan se obtiene en un hilo
+    # aparte y con otra conexión, así que la petición no espera por él. Los parámetros de
+    # columnas marcadas con info['sensible'] (user.password) se registran solo con tipo y largo.
+    PREFIJO_EXPLAIN = 'EXPLAIN QUERY PLAN '
+    MAX_PENDIENTES = 100
+
+    def __init__(self, umbral_ms, logger):
+        self.umbral = umbral_ms / 1000
+        self.logger = logger
+        self._cola = queue.Queue(self.MAX_PENDIENTES)
+        self._hilo = None
+        self._lock = threading.Lock()
+        self.sensibles = {
+            column.key for table in db.metadata.tables.values() for column in table.columns
+            if column.info.get('sensible')
+        }
+
+    def observar(self, conn, context, statement, parameters, executemany, duracion):
+        if duracion < self.umbral or statement.startswith(self.PREFIJO_EXPLAIN):
+            return
+        ruta = f'{request.method} {request.path}' if has_request_context() else '(fuera de una petición)'
+        if executemany and parameters:
+            parameters = parameters[0]
+        # El plan necesita los valores reales; al log va la copia sin valores sensibles
+        visibles = self._ocultar_sensibles(context, parameters)
+        try:
+            self._cola.put_nowait((conn.engine, statement, parameters, visibles, ruta, duracion))
+        except queue.Full:
+            self._registrar(statement, visibles, ruta, duracion, '(sin plan: demasiadas consultas lentas pendientes)')
+            return
+        self._iniciar()
+
+    def _ocultar_sensibles(self, context, parameters):
+        compiled = getattr(context, 'compiled', None)
+        if compiled is None or not parameters:
+            return parameters
+        # Nombre del parámetro ('password', 'password_1') o clave de origen (values(password=...))
+        ocultos = {
+            nombre for nombre, bind in compiled.binds.items()
+            if nombre in self.sensibles or getattr(bind, '_orig_key', None) in self.sensibles
+        }
+        if not ocultos:
+            return parameters
+        if isinstance(parameters, dict):
+            return {k: _resumen(v) if k in ocultos else v for k, v in parameters.items()}
+        nombres = compiled.positiontup or ()
+        if len(nombres) != len(parameters):
+            # No se puede saber qué posición es cuál: no se registra ningún valor
+            return tuple(_resumen(v) for v in parameters)
+        return tuple(_resumen(v) if n in ocultos else v for n, v in zip(nombres, parameters))
+
+    def _iniciar(self):
+        if self._hilo is None:
+            with self._lock:
+                if self._hilo is None:
+                    self._hilo = threading.Thread(target=self._trabajar, name='consultas-lentas', daemon=True)
+                    self._hilo.start()
+
+    def _trabajar(self):
+        while True:
+            engine, statement, parameters, visibles, ruta, duracion = self._cola.get()
+            try:
+                self._registrar(statement, visibles, ruta, duracion, self._plan(engine, statement, parameters))
+            finally:
+                self._cola.task_done()
+
+    def _plan(self, engine, statement, parameters):
+        if engine.dialect.name != 'sqlite':
+            return None
+        if isinstance(engine.pool, StaticPool) or engine.url.database in (None, '', ':memory:'):
+            # Base en memoria: engine.connect() devolvería la misma conexión de la petición y,
+            # al volver al pool, el rollback borraría su trabajo sin confirmar
+            return '(sin plan: base en memoria)'
+        try:
+            with engine.connect() as conn:
+                filas = conn.exec_driver_sql(self.PREFIJO_EXPLAIN + statement, parameters).all()
+        except Exception as exc:
+            return f'(no se pudo obtener el plan: {exc})'
+        # Filas (id, padre, _, detalle): se indenta según la profundidad en el árbol
+        profundidad = {}
+        lineas = []
+        for id_, padre, _, detalle in filas:
+            profundidad[id_] = profundidad.get(padre, -1) + 1
+            lineas.append('  ' * profundidad[id_] + detalle)
+        return '\n'.join(lineas)
+
+    def _registrar(self, statement, parameters, ruta, duracion, plan):
+        mensaje = ['Consulta lenta (%.1f ms) en %s:\n  %s\n  parámetros: %s']
+        args = [duracion * 1000, ruta, ' '.join(statement.split()), repr(parameters)[:500]]
+        if plan:
+            mensaje.append('\n  plan:\n%s')
+            args.append('\n'.join('    ' + linea for linea in plan.splitlines()))
+        self.logger.warning(''.join(mensaje), *args)
+
+
+def _resumen(valor):
+    largo = f', {len(valor)}' if isinstance(valor, (str, bytes)) else ''
+    return f'<{type(valor).__name__}{largo} oculto>'
+
+
+_estadisticas_peticion = ContextVar('estadisticas_peticion', default=None)
+_captura = ContextVar('captura_consultas', default=None)
+_consultas_lentas = None
+
+
+def _antes_de_ejecutar(conn, cursor, statement, parameters, context, executemany):
+    context._instrumentacion_inicio = time.perf_counter()
+
+
+def _despues_de_ejecutar(conn, cursor, statement, parameters, context, executemany):
+    inicio = getattr(context, '_instrumentacion_inicio', None)
+    if inicio is None:
+        return
+    duracion = time.perf_counter() - inicio
+    for estadisticas in (_estadisticas_peticion.get(), _captura.get()):
+        if estadisticas is not None:
+            estadisticas.registrar(statement, parameters, duracion)
+    if _consultas_lentas is not None:
+        _consultas_lentas.observar(conn, context, statement, parameters, executemany, duracion)
+
+
+def estadisticas_actuales():
+    return _estadisticas_peticion.get()
+
+
+class InstrumentacionSQL:
+    # Cuenta sentencias y tiempo de BD por petición, los expone en las cabeceras
+    # X-Query-Count / X-Query-Time (ms) y registra en el log las sospechas de N+1.
+    # Con SERVER_TIMING agrega la cabecera Server-Timing, que divide la latencia en
+    # db (SQL), tpl (render_template, sin el SQL que dispare la plantilla) y app (resto
+    # de la vista en Python). Solo usa perf_counter, así que puede quedar activa en producción.
+    # Las consultas de una respuesta en streaming (CSV) ocurren después de after_request
+    # y no entran en las cabeceras. El registro de consultas lentas funciona aunque
+    # INSTRUMENTACION_SQL esté apagado.
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        global _consultas_lentas
+        self.umbral_n_mas_1 = app.config.get('N_MAS_1_UMBRAL', 5)
+        if app.config.get('CONSULTA_LENTA_MS'):
+            _consultas_lentas = RegistroConsultasLentas(app.config['CONSULTA_LENTA_MS'], app.logger)
+        with app.app_context():
+            for engine in db.engines.values():
+                if not event.contains(engine, 'before_cursor_execute', _antes_de_ejecutar):
+                    event.listen(engine, 'before_cursor_execute', _antes_de_ejecutar)
+                    event.listen(engine, 'after_cursor_execute', _despues_de_ejecutar)
+        if not app.config.get('INSTRUMENTACION_SQL', True):
+            return
+        self.server_timing = app.config.get('SERVER_TIMING', True)
+        app.before_request(self._inicio_peticion)
+        app.after_request(self._fin_peticion)
+        app.teardown_request(self._limpiar)
+        before_render_template.connect(self._antes_plantilla, app)
+        template_rendered.connect(self._despues_plantilla, app)
+
+    def _antes_plantilla(self, sender, template, context, **extra):
+        estadisticas = _estadisticas_peticion.get()
+        if estadisticas is not None:
+            estadisticas._plantilla = (time.perf_counter(), estadisticas.tiempo)
+
+    def _despues_plantilla(self, sender, template, context, **extra):
+        estadisticas = _estadisticas_peticion.get()
+        if estadisticas is None or estadisticas._plantilla is None:
+            return
+        inicio, tiempo_bd = estadisticas._plantilla
+        estadisticas._plantilla = None
+        estadisticas.tiempo_plantillas += (time.perf_counter() - inicio) - (estadisticas.tiempo - tiempo_bd)
+
+    def _inicio_peticion(self):
+        g._token_estadisticas = _estadisticas_peticion.set(EstadisticasConsultas())
+
+    def _fin_peticion(self, response):
+        estadisticas = _estadisticas_peticion.get()
+        if estadisticas is None:
+            return response
+        response.headers['X-Query-Count'] = str(estadisticas.cantidad)
+        response.headers['X-Query-Time'] = f'{estadisticas.tiempo * 1000:.2f}'
+        if self.server_timing:
+            total = time.perf_counter() - estadisticas.inicio
+            vista = max(total - estadisticas.tiempo - estadisticas.tiempo_plantillas, 0.0)
+            response.headers.add('Server-Timing', ', '.join([
+                f'db;dur={estadisticas.tiempo * 1000:.2f};desc="SQL ({estadisticas.cantidad})"',
+                f'app;dur={vista * 1000:.2f};desc="Vista (Python)"',
+                f'tpl;dur={estadisticas.tiempo_plantillas * 1000:.2f};desc="Plantilla"',
+                f'total;dur={total * 1000:.2f}',
+            ]))
+        sospechas = estadisticas.sospechas_n_mas_1(self.umbral_n_mas_1)
+        if sospechas:
+            response.headers['X-Query-N-Plus-1'] = str(len(sospechas))
+            for statement, veces in sospechas:
+                current_app.logger.warning('Posible N+1 en %s %s: %d ejecuciones de %s',
+                                           request.method, request.path, veces, ' '.join(statement.split())[:200])
+        current_app.logger.debug('%s %s: %d consultas, %.1f ms en BD',
+                                 request.method, request.path, estadisticas.cantidad, estadisticas.tiempo * 1000)
+        return response
+
+    def _limpiar(self, exc):
+        token = g.pop('_token_estadisticas', None)
+        if token is not None:
+            _estadisticas_peticion.reset(token)
+
+
+@contextmanager
+def contar_consultas():
+    # Cuenta las sentencias ejecutadas dentro del bloque, p. ej. alrededor de client.get()
+    estadisticas = EstadisticasConsultas()
+    token = _captura.set(estadisticas)
+    try:
+        yield estadisticas
+    finally:
+        _captura.reset(token)
+
+
+def assert_max_consultas(client, url, maximo, method='GET', **kwargs):
+    # Ayuda para pruebas: falla si la ruta ejecuta más de `maximo` sentencias SQL
+    with contar_consultas() as estadisticas:
+        response = client.open(url, method=method, **kwargs)
+        response.get_data()  # consumir respuestas en streaming dentro del conteo
+    assert estadisticas.cantidad <= maximo, (
+        f'{method} {url} ejecutó {estadisticas.cantidad} consultas (máximo {maximo}):\n'
+        + '\n'.join(f'  {veces}x {" ".join(s.split())[:160]}' for s, (veces, _) in estadisticas.sentencias.items())
+    )
+    return response
@@ -0,0 +1,70 @@
+from collections import namedtuple
+
+from models import db, User, Area, Concepto, Gasto, GastoMensual, normalizar_nombre
+
+
+# Filas de solo lectura para las páginas de listado: tuplas con nombre con las columnas
+# que muestra la plantilla, sin identity map ni seguimiento de cambios de las entidades ORM
+# (los reportes hacen lo mismo con reportes.DetalleGasto)
+FilaGasto = namedtuple('FilaGasto', ['id', 'fecha', 'usuario', 'concepto', 'monto'])
+FilaUsuario = namedtuple('FilaUsuario', ['id', 'name', 'aporte', 'pagado'])
+
+
+def consulta_gastos():
+    # Select base de gastos con el nombre del usuario y del concepto; se le agregan filtros y orden
+    return (
+        db.select(Gasto.id, Gasto.fecha, User.name, Concepto.nombre, Gasto.monto)
+        .join(User, User.id == Gasto.usuario_id)
+        .join(Concepto, Concepto.id == Gasto.concepto_id)
+    )
+
+
+def filas_gastos(stmt):
+    return [FilaGasto(*r) for r in db.session.execute(stmt)]
+
+
+def gastos_recientes(limite):
+    return filas_gastos(consulta_gastos().order_by(Gasto.fecha.desc()).limit(limite))
+
+
+def totales_presupuesto():
+    # (presupuestado base de todos los conceptos, gastado acumulado de todos los meses)
+    return db.session.execute(db.select(
+        db.select(db.func.coalesce(db.func.sum(Concepto.valor_presupuestado), 0.0)).scalar_subquery(),
+        db.select(db.func.coalesce(db.func.sum(GastoMensual.total), 0.0))
+        .join(Concepto, Concepto.id == GastoMensual.concepto_id)
+        .scalar_subquery(),
+    )).one()
+
+
+def usuarios_con_pagado():
+    pagado = (
+        db.select(db.func.coalesce(db.func.sum(Gasto.monto), 0.0))
+        .where(Gasto.usuario_id == User.id)
+        .scalar_subquery()
+    )
+    rows = db.session.execute(db.select(User.id, User.name, User.aporte, pagado).order_by(User.id))
+    return [FilaUsuario(*r) for r in rows]
+
+
+def opciones_conceptos():
+    # (id, "Concepto (Área)") para los selects de gastos
+    rows = db.session.execute(
+        db.select(Concepto.id, Concepto.nombre, Area.nombre)
+        .join(Area, Area.id == Concepto.area_id)
+        .order_by(Concepto.id)
+    )
+    return [(concepto_id, f"{nombre} ({area})") for concepto_id, nombre, area in rows]
+
+
+def opciones_usuarios():
+    rows = db.session.execute(db.select(User.id, User.name).order_by(User.name))
+    return [(usuario_id, nombre) for usuario_id, nombre in rows]
+
+
+def nombres_equivalentes(nombre, excluir_id=None):
+    # Conceptos cuyo nombre normalizado coincide (búsqueda por ix_concepto_nombre_normalizado)
+    stmt = db.select(Concepto.nombre).where(Concepto.nombre_normalizado == normalizar_nombre(nombre)[0])
+    if excluir_id is not None:
+        stmt = stmt.where(Concepto.id != excluir_id)
+    return db.session.scalars(stmt.order_by(Concepto.id)).all()
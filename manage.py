@@ -1,6 +1,6 @@
 from app import app
-from models import db
+from models import actualizar_esquema
 
 with app.app_context():
-    db.create_all()
+    actualizar_esquema()
     print('BD creada')
\ No newline at end of file
@@ -0,0 +1,164 @@
+from bisect import bisect_left
+import itertools
+import threading
+import time
+
+from flask import Response, abort, g, request
+
+from cache import cache_respuestas
+from instrumentacion import estadisticas_actuales
+
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+DIRECCIONES_LOCALES = ('127.0.0.1', '::1')
+FRAGMENTOS = 16
+
+
+class _Fragmento:
+    # Contadores de un grupo de hilos, con su propio lock; se suman al exportar
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.peticiones = {}   # (endpoint, método, estado) -> n
+        self.latencias = {}    # endpoint -> [n por bucket..., +Inf, suma]
+        self.consultas = {}    # endpoint -> [sentencias, segundos en BD]
+
+
+class Metricas:
+    # Métricas en formato de texto de Prometheus servidas en /metrics (solo desde localhost,
+    # salvo METRICAS_PERMITIR_REMOTO). Los contadores se reparten en FRAGMENTOS fijos, cada uno
+    # con su lock, y a cada hilo se le asigna uno en rueda: los hilos concurrentes casi nunca
+    # comparten lock, y la cantidad de fragmentos no crece aunque el servidor cree un hilo por
+    # petición (como el servidor con hilos de werkzeug).
+
+    def __init__(self, app=None):
+        self._local = threading.local()
+        self._siguiente = itertools.count()
+        self._fragmentos = [_Fragmento() for _ in range(FRAGMENTOS)]
+        self._colectores = []
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.permitir_remoto = app.config.get('METRICAS_PERMITIR_REMOTO', False)
+        app.before_request(self._inicio_peticion)
+        app.after_request(self._fin_peticion)
+        app.add_url_rule('/metrics', 'metrics', self._vista)
+
+    def agregar_colector(self, colector):
+        # colector() devuelve líneas adicionales en formato de texto de Prometheus
+        self._colectores.append(colector)
+
+    def _fragmento(self):
+        fragmento = getattr(self._local, 'fragmento', None)
+        if fragmento is None:
+            # next() sobre itertools.count es atómico bajo el GIL
+            fragmento = self._local.fragmento = self._fragmentos[next(self._siguiente) % FRAGMENTOS]
+        return fragmento
+
+    def _inicio_peticion(self):
+        g._metricas_inicio = time.perf_counter()
+
+    def _fin_peticion(self, response):
+        inicio = g.pop('_metricas_inicio', None)
+        if inicio is None:
+            return response
+        duracion = time.perf_counter() - inicio
+        endpoint = request.endpoint or 'desconocido'
+        fragmento = self._fragmento()
+        clave = (endpoint, request.method, response.status_code)
+        estadisticas = estadisticas_actuales()
+        with fragmento.lock:
+            fragmento.peticiones[clave] = fragmento.peticiones.get(clave, 0) + 1
+
+            latencias = fragmento.latencias.get(endpoint)
+            if latencias is None:
+                latencias = fragmento.latencias[endpoint] = [0] * (len(BUCKETS) + 2)
+            latencias[bisect_left(BUCKETS, duracion)] += 1
+            latencias[-1] += duracion
+
+            if estadisticas is not None:
+                consultas = fragmento.consultas.get(endpoint)
+                if consultas is None:
+                    consultas = fragmento.consultas[endpoint] = [0, 0.0]
+                consultas[0] += estadisticas.cantidad
+                consultas[1] += estadisticas.tiempo
+        return response
+
+    def _vista(self):
+        if not self.permitir_remoto and request.remote_addr not in DIRECCIONES_LOCALES:
+            abort(403)
+        return Response(self.exportar(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+    def exportar(self):
+        peticiones, latencias, consultas = {}, {}, {}
+        for f in self._fragmentos:
+            with f.lock:
+                f_peticiones = dict(f.peticiones)
+                f_latencias = {endpoint: list(valores) for endpoint, valores in f.latencias.items()}
+                f_consultas = {endpoint: tuple(valores) for endpoint, valores in f.consultas.items()}
+            for clave, n in f_peticiones.items():
+                peticiones[clave] = peticiones.get(clave, 0) + n
+            for endpoint, valores in f_latencias.items():
+                acumulado = latencias.setdefault(endpoint, [0] * len(valores))
+                for i, v in enumerate(valores):
+                    acumulado[i] += v
+            for endpoint, (n, segundos) in f_consultas.items():
+                acumulado = consultas.setdefault(endpoint, [0, 0.0])
+                acumulado[0] += n
+                acumulado[1] += segundos
+
+        lineas = [
+            '# HELP presupuesto_http_peticiones_total Peticiones atendidas.',
+            '# TYPE presupuesto_http_peticiones_total counter',
+        ]
+        for (endpoint, metodo, estado), n in sorted(peticiones.items()):
+            lineas.append(f'presupuesto_http_peticiones_total{{endpoint="{endpoint}",metodo="{metodo}",estado="{estado}"}} {n}')
+
+        lineas += [
+            '# HELP presupuesto_http_duracion_segundos Latencia de las peticiones.',
+            '# TYPE presupuesto_http_duracion_segundos histogram',
+        ]
+        for endpoint, valores in sorted(latencias.items()):
+            acumulado = 0
+            for limite, n in zip(BUCKETS + ('+Inf',), valores[:-1]):
+                acumulado += n
+                lineas.append(f'presupuesto_http_duracion_segundos_bucket{{endpoint="{endpoint}",le="{limite}"}} {acumulado}')
+            lineas.append(f'presupuesto_http_duracion_segundos_sum{{endpoint="{endpoint}"}} {valores[-1]:.6f}')
+            lineas.append(f'presupuesto_http_duracion_segundos_count{{endpoint="{endpoint}"}} {acumulado}')
+
+        lineas += [
+            '# HELP presupuesto_sql_consultas_total Sentencias SQL ejecutadas por endpoint.',
+            '# TYPE presupuesto_sql_consultas_total counter',
+        ]
+        for endpoint, (n, _) in sorted(consultas.items()):
+            lineas.append(f'presupuesto_sql_consultas_total{{endpoint="{endpoint}"}} {n}')
+        lineas += [
+            '# HELP presupuesto_sql_duracion_segundos_total Tiempo en la base de datos por endpoint.',
+            '# TYPE presupuesto_sql_duracion_segundos_total counter',
+        ]
+        for endpoint, (_, segundos) in sorted(consultas.items()):
+            lineas.append(f'presupuesto_sql_duracion_segundos_total{{endpoint="{endpoint}"}} {segundos:.6f}')
+
+        cache = cache_respuestas.estadisticas()
+        consultas_cache = cache['aciertos'] + cache['fallos']
+        lineas += [
+            '# HELP presupuesto_cache_aciertos_total Respuestas servidas desde la cache.',
+            '# TYPE presupuesto_cache_aciertos_total counter',
+            f'presupuesto_cache_aciertos_total {cache["aciertos"]}',
+            '# HELP presupuesto_cache_fallos_total Respuestas que no estaban en la cache.',
+            '# TYPE presupuesto_cache_fallos_total counter',
+            f'presupuesto_cache_fallos_total {cache["fallos"]}',
+            '# HELP presupuesto_cache_ratio_aciertos Proporción de aciertos desde el arranque.',
+            '# TYPE presupuesto_cache_ratio_aciertos gauge',
+            f'presupuesto_cache_ratio_aciertos {(cache["aciertos"] / consultas_cache) if consultas_cache else 0:.4f}',
+            '# HELP presupuesto_cache_entradas Entradas en la cache de respuestas.',
+            '# TYPE presupuesto_cache_entradas gauge',
+            f'presupuesto_cache_entradas {cache["entradas"]}',
+            '# HELP presupuesto_cache_bytes Bytes ocupados por la cache de respuestas.',
+            '# TYPE presupuesto_cache_bytes gauge',
+            f'presupuesto_cache_bytes {cache["bytes"]}',
+        ]
+
+        for colector in self._colectores:
+            lineas.extend(colector())
+        return '\n'.join(lineas) + '\n'
@@ -1,16 +1,31 @@
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
 from datetime import datetime
+import re
+import unicodedata
+from sqlalchemy import event, extract, func, inspect as sa_inspect
+from sqlalchemy.ext.hybrid import hybrid_property
+from sqlalchemy.orm import attributes, column_property, query_expression, validates, with_expression
 
 
 db = SQLAlchemy()
 
 
+def normalizar_nombre(nombre):
+    # trim, colapsar espacios, sin acentos, lower. Devuelve (clave, nombre colapsado)
+    name_strip = (nombre or '').strip()
+    name_collapsed = re.sub(r"\s+", " ", name_strip)
+    name_nfd = unicodedata.normalize('NFD', name_collapsed)
+    name_no_accents = ''.join(ch for ch in name_nfd if unicodedata.category(ch) != 'Mn')
+    return name_no_accents.lower(), name_collapsed
+
+
 class User(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(120), nullable=False)
     email = db.Column(db.String(120), unique=True, nullable=False)
-    password = db.Column(db.String(200), nullable=False) # simple: store plaintext? in real app hash it
+    # info['sensible']: el registro de consultas lentas no escribe su valor (ver instrumentacion.py)
+    password = db.Column(db.String(200), nullable=False, info={'sensible': True}) # simple: store plaintext? in real app hash it
     aporte = db.Column(db.Float, default=0.5) # porcentaje (0-1)
     gastos = db.relationship('Gasto', backref='user', lazy=True)
 
@@ -24,25 +39,68 @@ class Area(db.Model):
 class Concepto(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     nombre = db.Column(db.String(120), nullable=False)
+    # Clave de agrupación de los reportes (normalizar_nombre); se mantiene al asignar nombre
+    nombre_normalizado = db.Column(db.String(120), index=True)
     valor_presupuestado = db.Column(db.Float, default=0.0)
     area_id = db.Column(db.Integer, db.ForeignKey('area.id'), nullable=False)
     gastos = db.relationship('Gasto', backref='concepto', lazy=True)
+    # Total gastado calculado en SQL; solo se llena al consultar con Concepto.con_totales()
+    total_gastado_sql = query_expression()
+
+    @validates('nombre')
+    def _normalizar(self, key, nombre):
+        self.nombre_normalizado = normalizar_nombre(nombre)[0]
+        return nombre
 
-    @property
+    @hybrid_property
     def total_gastado(self):
+        if self.total_gastado_sql is not None:
+            return self.total_gastado_sql
+        # Respaldo: sumar en Python cargando la relación completa
         return sum(g.monto for g in self.gastos)
 
-    @property
+    @total_gastado.expression
+    def total_gastado(cls):
+        return (
+            db.select(func.coalesce(func.sum(GastoMensual.total), 0.0))
+            .where(GastoMensual.concepto_id == cls.id)
+            .scalar_subquery()
+        )
+
+    @hybrid_property
     def restante(self):
         return max(self.valor_presupuestado - self.total_gastado, 0)
 
+    @restante.expression
+    def restante(cls):
+        diferencia = func.coalesce(cls.valor_presupuestado, 0.0) - cls.total_gastado
+        return db.case((diferencia > 0, diferencia), else_=0.0)
+
+    @classmethod
+    def con_totales(cls):
+        # Consulta de conceptos con el total gastado resuelto en la misma sentencia
+        return cls.query.options(with_expression(cls.total_gastado_sql, cls.total_gastado))
+
 
 class Gasto(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    concepto_id = db.Column(db.Integer, db.ForeignKey('concepto.id'), nullable=False)
+    # active_history: al asignar sobre un objeto expirado (cargado antes del último commit)
+    # se carga primero el valor guardado, que los eventos de gasto_mensual necesitan para
+    # restar el gasto de su mes anterior
+    concepto_id = column_property(db.Column(db.Integer, db.ForeignKey('concepto.id'), nullable=False),
+                                  active_history=True)
     usuario_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    monto = db.Column(db.Float, nullable=False)
-    fecha = db.Column(db.DateTime, default=datetime.utcnow)
+    monto = column_property(db.Column(db.Float, nullable=False), active_history=True)
+    fecha = column_property(db.Column(db.DateTime, default=datetime.utcnow), active_history=True)
+
+    # Filtros por mes como rangos semiabiertos sobre fecha (ver reportes.rango_mes)
+    __table_args__ = (
+        db.Index('ix_gasto_concepto_fecha', 'concepto_id', 'fecha'),
+        db.Index('ix_gasto_usuario_fecha', 'usuario_id', 'fecha'),
+        db.Index('ix_gasto_fecha', 'fecha'),
+        # Filtros monto_min/monto_max del listado de gastos (ver app.paginar_gastos)
+        db.Index('ix_gasto_monto', 'monto'),
+    )
 
 
 class PresupuestoMensual(db.Model):
@@ -51,9 +109,226 @@ class PresupuestoMensual(db.Model):
     year = db.Column(db.Integer, nullable=False)
     month = db.Column(db.Integer, nullable=False)  # 1-12
     valor_presupuestado = db.Column(db.Float, nullable=False)
+    actualizado = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
     concepto = db.relationship('Concepto', backref=db.backref('presupuestos_mensuales', lazy=True))
 
     __table_args__ = (
         db.UniqueConstraint('concepto_id', 'year', 'month', name='uq_concepto_mes'),
-    )
\ No newline at end of file
+        # reportes.marca_modificacion filtra por rango de meses sin concepto; uq_concepto_mes
+        # empieza por concepto_id y no sirve para esa búsqueda
+        db.Index('ix_presupuesto_mensual_mes', 'year', 'month'),
+    )
+
+
+class GastoMensual(db.Model):
+    # Acumulado de gastos por concepto y mes. Se mantiene en cada escritura de Gasto
+    # para que los reportes no tengan que recorrer todo el historial.
+    __tablename__ = 'gasto_mensual'
+    concepto_id = db.Column(db.Integer, db.ForeignKey('concepto.id'), primary_key=True)
+    year = db.Column(db.Integer, primary_key=True)
+    month = db.Column(db.Integer, primary_key=True)  # 1-12
+    total = db.Column(db.Float, nullable=False, default=0.0)
+    cantidad = db.Column(db.Integer, nullable=False, default=0)
+    actualizado = db.Column(db.DateTime)
+
+    __table_args__ = (
+        db.Index('ix_gasto_mensual_mes', 'year', 'month'),
+    )
+
+
+class MarcaCambios(db.Model):
+    # Última modificación de datos sin marca propia por mes (clave 'catalogo':
+    # conceptos, áreas y usuarios). Se actualiza con eventos en la misma transacción.
+    # La clave 'datos' cambia con cualquier escritura de las vistas (ver
+    # basedatos.reintentar_escritura) y su versión es la generación de la cache de respuestas
+    # compartida por todos los procesos.
+    __tablename__ = 'marca_cambios'
+    clave = db.Column(db.String(40), primary_key=True)
+    actualizado = db.Column(db.DateTime, nullable=False)
+    version = db.Column(db.Integer, default=0)  # nullable para poder agregarla con ALTER TABLE
+
+
+def insert_on_conflict(connection, table):
+    # INSERT ... ON CONFLICT del dialecto en uso (SQLite o PostgreSQL)
+    if connection.dialect.name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert(table)
+
+
+def aplicar_deltas_gasto_mensual(connection, deltas):
+    # deltas: {(concepto_id, year, month): (monto, cantidad)}
+    ahora = datetime.utcnow()
+    rows = [
+        {'concepto_id': k[0], 'year': k[1], 'month': k[2], 'total': v[0], 'cantidad': v[1], 'actualizado': ahora}
+        for k, v in deltas.items() if v[1] != 0 or v[0] != 0
+    ]
+    if not rows:
+        return
+    table = GastoMensual.__table__
+    stmt = insert_on_conflict(connection, table)
+    cantidad = table.c.cantidad + stmt.excluded.cantidad
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c.concepto_id, table.c.year, table.c.month],
+        set_={
+            # Un mes que queda sin gastos vuelve a 0 exacto, sin residuos de redondeo.
+            # La fila se conserva para que su marca 'actualizado' refleje el borrado.
+            'total': db.case((cantidad == 0, 0.0), else_=table.c.total + stmt.excluded.total),
+            'cantidad': cantidad,
+            'actualizado': stmt.excluded.actualizado,
+        },
+    )
+    connection.execute(stmt, rows)
+
+
+def guardar_presupuestos_mensuales(year, month, valores):
+    # valores: {concepto_id: valor_presupuestado}. Un único INSERT ... ON CONFLICT sobre
+    # uq_concepto_mes, atómico frente a otro usuario planificando el mismo mes.
+    if not valores:
+        return
+    connection = db.session.connection()
+    table = PresupuestoMensual.__table__
+    ahora = datetime.utcnow()
+    stmt = insert_on_conflict(connection, table).values([
+        {'concepto_id': concepto_id, 'year': year, 'month': month, 'valor_presupuestado': valor, 'actualizado': ahora}
+        for concepto_id, valor in valores.items()
+    ])
+    connection.execute(stmt.on_conflict_do_update(
+        index_elements=[table.c.concepto_id, table.c.year, table.c.month],
+        set_={'valor_presupuestado': stmt.excluded.valor_presupuestado, 'actualizado': stmt.excluded.actualizado},
+    ))
+
+
+def reconstruir_gasto_mensual():
+    # Recalcula la tabla de acumulados desde cero a partir de Gasto
+    table = GastoMensual.__table__
+    year = extract('year', Gasto.fecha)
+    month = extract('month', Gasto.fecha)
+    origen = (
+        db.select(Gasto.concepto_id, year, month, func.sum(Gasto.monto), func.count(Gasto.id),
+                  db.literal(datetime.utcnow(), db.DateTime))
+        .where(Gasto.fecha.is_not(None))
+        .group_by(Gasto.concepto_id, year, month)
+    )
+    db.session.execute(table.delete())
+    db.session.execute(
+        table.insert().from_select(['concepto_id', 'year', 'month', 'total', 'cantidad', 'actualizado'], origen)
+    )
+    db.session.commit()
+
+
+def _valor_previo(target, attr):
+    hist = attributes.get_history(target, attr)
+    if hist.deleted:
+        return hist.deleted[0]
+    if hist.unchanged:
+        return hist.unchanged[0]
+    return getattr(target, attr)
+
+
+def _clave_mes(concepto_id, fecha):
+    return (concepto_id, fecha.year, fecha.month)
+
+
+@event.listens_for(Gasto, 'after_insert')
+def _gasto_insertado(mapper, connection, target):
+    if target.fecha is None:
+        return
+    aplicar_deltas_gasto_mensual(connection, {_clave_mes(target.concepto_id, target.fecha): (target.monto, 1)})
+
+
+@event.listens_for(Gasto, 'after_update')
+def _gasto_actualizado(mapper, connection, target):
+    state = sa_inspect(target)
+    if not any(state.attrs[a].history.has_changes() for a in ('concepto_id', 'fecha', 'monto')):
+        return
+    deltas = {}
+    fecha_prev = _valor_previo(target, 'fecha')
+    if fecha_prev is not None:
+        k = _clave_mes(_valor_previo(target, 'concepto_id'), fecha_prev)
+        deltas[k] = (-_valor_previo(target, 'monto'), -1)
+    if target.fecha is not None:
+        k = _clave_mes(target.concepto_id, target.fecha)
+        monto, cantidad = deltas.get(k, (0.0, 0))
+        deltas[k] = (monto + target.monto, cantidad + 1)
+    aplicar_deltas_gasto_mensual(connection, deltas)
+
+
+@event.listens_for(Gasto, 'after_delete')
+def _gasto_eliminado(mapper, connection, target):
+    fecha = _valor_previo(target, 'fecha')
+    if fecha is None:
+        return
+    k = _clave_mes(_valor_previo(target, 'concepto_id'), fecha)
+    aplicar_deltas_gasto_mensual(connection, {k: (-_valor_previo(target, 'monto'), -1)})
+
+
+def marcar_cambio(connection, clave):
+    table = MarcaCambios.__table__
+    stmt = insert_on_conflict(connection, table).values(clave=clave, actualizado=datetime.utcnow(), version=1)
+    connection.execute(stmt.on_conflict_do_update(
+        index_elements=[table.c.clave],
+        # La versión distingue dos cambios aunque caigan en el mismo microsegundo
+        set_={'actualizado': stmt.excluded.actualizado, 'version': func.coalesce(table.c.version, 0) + 1},
+    ))
+
+
+def _marcar_catalogo(mapper, connection, target):
+    marcar_cambio(connection, 'catalogo')
+
+
+for _modelo in (User, Area, Concepto):
+    for _evento in ('after_insert', 'after_update', 'after_delete'):
+        event.listen(_modelo, _evento, _marcar_catalogo)
+
+
+def _agregar_columnas_faltantes():
+    # create_all no altera tablas existentes: agrega con ALTER TABLE las columnas nuevas.
+    # Los nombres van citados por el dialecto ('user' es palabra reservada en PostgreSQL).
+    inspector = sa_inspect(db.engine)
+    with db.engine.begin() as connection:
+        citar = connection.dialect.identifier_preparer.quote
+        for table in db.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existentes = {c['name'] for c in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existentes:
+                    tipo = column.type.compile(dialect=connection.dialect)
+                    connection.exec_driver_sql(
+                        f'ALTER TABLE {citar(table.name)} ADD COLUMN {citar(column.name)} {tipo}'
+                    )
+
+
+def _completar_nombres_normalizados():
+    # Conceptos sin clave: anteriores a la columna o insertados sin pasar por el ORM
+    table = Concepto.__table__
+    with db.engine.begin() as connection:
+        filas = [
+            {'b_id': c_id, 'b_clave': normalizar_nombre(nombre)[0]}
+            for c_id, nombre in connection.execute(
+                db.select(table.c.id, table.c.nombre).where(table.c.nombre_normalizado.is_(None))
+            )
+        ]
+        if filas:
+            connection.execute(
+                table.update().where(table.c.id == db.bindparam('b_id'))
+                .values(nombre_normalizado=db.bindparam('b_clave')),
+                filas,
+            )
+
+
+def actualizar_esquema():
+    # Crea las tablas, columnas e índices que falten y llena los acumulados si la tabla es nueva.
+    # create_all no agrega índices nuevos a tablas que ya existen, por eso se crean aparte.
+    nueva_tabla = not sa_inspect(db.engine).has_table(GastoMensual.__tablename__)
+    _agregar_columnas_faltantes()
+    db.create_all()
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=db.engine, checkfirst=True)
+    _completar_nombres_normalizados()
+    if nueva_tabla:
+        reconstruir_gasto_mensual()
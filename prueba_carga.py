@@ -0,0 +1,289 @@
+"""Prueba de carga contra la app servida por werkzeug en un proceso aparte.
+
+    python prueba_carga.py --usuarios 8 --duracion 30
+    python prueba_carga.py --usuarios 8 --procesos 4          # servidor multiproceso
+    python prueba_carga.py --db instance/shared_budget.sqlite  # sobre una copia de otra base
+
+Cada miembro del hogar simulado es un hilo con su propia sesión: inicia sesión con el token
+CSRF del formulario y luego mezcla dashboard, listado y registro de gastos, reportes,
+exportaciones CSV y cierres de sesión según PESOS. La base se copia antes de empezar (los
+POST escriben). Al final se informa throughput, tasa de error, latencias por acción y las
+apariciones de "database is locked" en el log del servidor.
+"""
+import argparse
+from http.client import HTTPConnection
+import json
+import os
+import random
+import re
+import shutil
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from urllib.parse import urlencode
+
+BASE_DIR = os.path.abspath(os.path.dirname(__file__))
+
+# acción -> peso relativo en el tráfico mixto
+PESOS = {
+    'dashboard': 20,
+    'gastos': 15,
+    'registrar_gasto': 20,
+    'reporte_mes': 20,
+    'reporte_csv': 10,
+    'conceptos': 5,
+    'relogin': 5,
+    'presupuestar': 5,
+}
+
+# Los POST exitosos redirigen; un 200 significa que el formulario fue rechazado
+ACCIONES_CON_REDIRECCION = {'login', 'relogin', 'registrar_gasto'}
+
+CSRF = re.compile(r'name="csrf_token"[^>]*value="([^"]+)"')
+
+
+def puerto_libre():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def servir(ruta_db, puerto, procesos):
+    # Se ejecuta en el subproceso del servidor
+    os.environ['DATABASE_URL'] = 'sqlite:///' + ruta_db
+    os.environ.setdefault('CONSULTA_LENTA_MS', '0')
+    sys.path.insert(0, BASE_DIR)
+    import logging
+    from werkzeug.serving import run_simple
+    from app import app
+
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    run_simple('127.0.0.1', puerto, app, threaded=procesos == 1, processes=procesos, use_reloader=False)
+
+
+class Cliente:
+    # Sesión HTTP mínima con cookies, sin seguir redirecciones
+    def __init__(self, puerto):
+        self.conexion = HTTPConnection('127.0.0.1', puerto, timeout=60)
+        self.cookies = {}
+
+    def pedir(self, metodo, ruta, datos=None):
+        headers = {}
+        if self.cookies:
+            headers['Cookie'] = '; '.join(f'{k}={v}' for k, v in self.cookies.items())
+        body = None
+        if datos is not None:
+            body = urlencode(datos)
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        try:
+            self.conexion.request(metodo, ruta, body, headers)
+            r = self.conexion.getresponse()
+            cuerpo = r.read()
+        except (OSError, ConnectionError):
+            self.conexion.close()
+            raise
+        for cookie in r.headers.get_all('Set-Cookie') or []:
+            nombre, _, resto = cookie.partition('=')
+            self.cookies[nombre.strip()] = resto.split(';', 1)[0]
+        return r.status, cuerpo
+
+    def token(self, ruta):
+        status, cuerpo = self.pedir('GET', ruta)
+        m = CSRF.search(cuerpo.decode('utf-8', 'replace'))
+        return status, (m.group(1) if m else '')
+
+
+class Miembro(threading.Thread):
+    def __init__(self, numero, puerto, email, conceptos, fin, semilla):
+        super().__init__(name=f'miembro-{numero}', daemon=True)
+        self.cliente = Cliente(puerto)
+        self.email = email
+        self.conceptos = conceptos
+        self.fin = fin
+        self.rng = random.Random(semilla)
+        self.registros = []   # (acción, status, segundos)
+
+    def medir(self, accion, funcion):
+        inicio = time.perf_counter()
+        try:
+            status = funcion()
+        except OSError as exc:
+            status = f'error: {exc.__class__.__name__}'
+        self.registros.append((accion, status, time.perf_counter() - inicio))
+
+    def login(self):
+        _, token = self.cliente.token('/login')
+        return self.cliente.pedir('POST', '/login', {'csrf_token': token, 'email': self.email, 'password': 'password'})[0]
+
+    def relogin(self):
+        self.cliente.pedir('GET', '/logout')
+        return self.login()
+
+    def registrar_gasto(self):
+        _, token = self.cliente.token('/gastos')
+        return self.cliente.pedir('POST', '/gastos', {
+            'csrf_token': token,
+            'concepto_id': self.rng.choice(self.conceptos),
+            'monto': self.rng.randrange(1000, 200000, 100),
+            'fecha': f'2026-{self.rng.randint(1, 12):02d}-{self.rng.randint(1, 28):02d}',
+        })[0]
+
+    def accion(self, nombre):
+        mes = self.rng.randint(1, 12)
+        return {
+            'dashboard': lambda: self.cliente.pedir('GET', '/dashboard')[0],
+            'gastos': lambda: self.cliente.pedir('GET', '/gastos')[0],
+            'registrar_gasto': self.registrar_gasto,
+            'reporte_mes': lambda: self.cliente.pedir('GET', f'/reporte_mes?year=2026&month={mes}')[0],
+            'reporte_csv': lambda: self.cliente.pedir('GET', f'/reporte_mes?year=2026&month={mes}&format=csv')[0],
+            'conceptos': lambda: self.cliente.pedir('GET', '/conceptos')[0],
+            'relogin': self.relogin,
+            'presupuestar': lambda: self.cliente.pedir('GET', '/presupuestar_mes_siguiente')[0],
+        }[nombre]
+
+    def run(self):
+        self.medir('login', self.login)
+        acciones = list(PESOS)
+        pesos = list(PESOS.values())
+        while time.monotonic() < self.fin:
+            nombre = self.rng.choices(acciones, weights=pesos)[0]
+            self.medir(nombre, self.accion(nombre))
+
+
+def es_error(accion, status):
+    if not isinstance(status, int) or status >= 400:
+        return True
+    return accion in ACCIONES_CON_REDIRECCION and status != 302
+
+
+def percentil(valores, p):
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, int(round(p / 100 * (len(ordenados) - 1))))]
+
+
+def esperar_servidor(puerto, proceso, limite=30):
+    fin = time.monotonic() + limite
+    while time.monotonic() < fin:
+        if proceso.poll() is not None:
+            raise SystemExit('El servidor terminó al arrancar; ver su log')
+        try:
+            socket.create_connection(('127.0.0.1', puerto), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise SystemExit('El servidor no respondió a tiempo')
+
+
+def datos_base(ruta_db):
+    con = sqlite3.connect(ruta_db)
+    try:
+        emails = [e for (e,) in con.execute('SELECT email FROM user ORDER BY id')]
+        conceptos = [c for (c,) in con.execute('SELECT id FROM concepto ORDER BY id')]
+    finally:
+        con.close()
+    return emails, conceptos
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Prueba de carga con tráfico mixto.')
+    parser.add_argument('--usuarios', type=int, default=8, help='miembros del hogar simulados (hilos cliente)')
+    parser.add_argument('--duracion', type=float, default=30, help='segundos de carga')
+    parser.add_argument('--procesos', type=int, default=1, help='1 = servidor con hilos; >1 = un proceso por petición, hasta N')
+    parser.add_argument('--db', help='base a copiar (por defecto la base "mediana" de bench_rutas.py)')
+    parser.add_argument('--semilla', type=int, default=7)
+    parser.add_argument('--salida', help='guardar el resumen en JSON')
+    parser.add_argument('--servir', help=argparse.SUPPRESS)
+    parser.add_argument('--puerto', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.servir:
+        servir(args.servir, args.puerto, args.procesos)
+        return 0
+
+    if args.db:
+        original = args.db
+    else:
+        from bench_rutas import base_de_datos
+        original = base_de_datos('mediana')
+    directorio = tempfile.mkdtemp(prefix='carga-')
+    copia = os.path.join(directorio, 'carga.sqlite')
+    shutil.copyfile(original, copia)
+    emails, conceptos = datos_base(copia)
+    if not emails or not conceptos:
+        parser.error('la base necesita usuarios (con contraseña "password") y conceptos')
+
+    puerto = puerto_libre()
+    log_servidor = os.path.join(directorio, 'servidor.log')
+    with open(log_servidor, 'w') as log:
+        servidor = subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), '--servir', copia, '--puerto', str(puerto),
+             '--procesos', str(args.procesos)],
+            stdout=log, stderr=subprocess.STDOUT,
+        )
+    try:
+        esperar_servidor(puerto, servidor)
+        inicio = time.monotonic()
+        fin = inicio + args.duracion
+        miembros = [
+            Miembro(i, puerto, emails[i % len(emails)], conceptos, fin, args.semilla * 1000 + i)
+            for i in range(args.usuarios)
+        ]
+        for m in miembros:
+            m.start()
+        for m in miembros:
+            m.join()
+        transcurrido = time.monotonic() - inicio
+    finally:
+        servidor.terminate()
+        servidor.wait()
+
+    with open(log_servidor, encoding='utf-8', errors='replace') as f:
+        log = f.read()
+    registros = [r for m in miembros for r in m.registros]
+    por_accion = {}
+    for accion, status, segundos in registros:
+        por_accion.setdefault(accion, []).append((status, segundos))
+    errores = sum(1 for accion, status, _ in registros if es_error(accion, status))
+    resumen = {
+        'usuarios': args.usuarios,
+        'procesos': args.procesos,
+        'segundos': round(transcurrido, 1),
+        'peticiones': len(registros),
+        'throughput': round(len(registros) / transcurrido, 1),
+        'errores': errores,
+        'tasa_error': round(errores / len(registros), 4) if registros else 0,
+        'database_is_locked': log.count('database is locked'),
+        'acciones': {
+            accion: {
+                'peticiones': len(valores),
+                'errores': sum(1 for status, _ in valores if es_error(accion, status)),
+                'p50_ms': round(percentil([s for _, s in valores], 50) * 1000, 1),
+                'p95_ms': round(percentil([s for _, s in valores], 95) * 1000, 1),
+            }
+            for accion, valores in sorted(por_accion.items())
+        },
+    }
+
+    modo = 'hilos' if args.procesos == 1 else f'{args.procesos} procesos'
+    print(f'{args.usuarios} usuarios, servidor con {modo}, {resumen["segundos"]} s')
+    print(f'{resumen["peticiones"]} peticiones, {resumen["throughput"]} req/s, '
+          f'{errores} errores ({resumen["tasa_error"]:.2%}), "database is locked": {resumen["database_is_locked"]}')
+    print(f'\n  {"acción":18} {"peticiones":>10} {"errores":>8} {"p50 ms":>9} {"p95 ms":>9}')
+    for accion, a in resumen['acciones'].items():
+        print(f'  {accion:18} {a["peticiones"]:10d} {a["errores"]:8d} {a["p50_ms"]:9.1f} {a["p95_ms"]:9.1f}')
+    if errores:
+        print(f'\nLog del servidor: {log_servidor}')
+    else:
+        shutil.rmtree(directorio, ignore_errors=True)
+    if args.salida:
+        with open(args.salida, 'w', encoding='utf-8') as f:
+            json.dump(resumen, f, indent=2, ensure_ascii=False)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,253 @@
+from collections import namedtuple
+from datetime import datetime
+import csv
+import hashlib
+
+from models import db, User, Area, Concepto, Gasto, PresupuestoMensual, GastoMensual, MarcaCambios, \
+    normalizar_nombre
+
+
+# Fila de detalle de un gasto dentro del reporte (sin cargar entidades ORM); grupo es el
+# nombre normalizado de su concepto
+DetalleGasto = namedtuple('DetalleGasto', ['grupo', 'fecha', 'usuario', 'monto'])
+
+
+def rango_mes(year, month):
+    # Rango semiabierto [primer día del mes, primer día del mes siguiente)
+    first_day = datetime(year, month, 1)
+    if month == 12:
+        next_month_first = datetime(year + 1, 1, 1)
+    else:
+        next_month_first = datetime(year, month + 1, 1)
+    return first_day, next_month_first
+
+
+def clasificar_estado(presupuestado, pendiente):
+    if pendiente < 0:
+        return 'red'
+    if pendiente == 0:
+        return 'green'
+    if presupuestado > 0 and pendiente == presupuestado:
+        return 'yellow'
+    ratio = 0 if presupuestado == 0 else (pendiente / presupuestado)
+    return 'lilac' if ratio < 0.2 else 'orange'
+
+
+def grupos_mes(y, m):
+    # Conceptos agrupados en SQL por nombre normalizado, con el presupuesto efectivo (el
+    # mensual si existe, si no el valor base) y lo gastado en el mes. El nombre y el área
+    # que se muestran son los del concepto más antiguo del grupo.
+    pm, gm = PresupuestoMensual, GastoMensual
+    grupos = (
+        db.select(
+            Concepto.nombre_normalizado.label('clave'),
+            db.func.min(Concepto.id).label('primer_id'),
+            db.func.count(Concepto.id).label('conceptos'),
+            db.func.sum(db.func.coalesce(pm.valor_presupuestado, Concepto.valor_presupuestado, 0.0)).label('presupuestado'),
+            db.func.sum(db.func.coalesce(gm.total, 0.0)).label('gastado'),
+        )
+        .outerjoin(pm, db.and_(pm.concepto_id == Concepto.id, pm.year == y, pm.month == m))
+        .outerjoin(gm, db.and_(gm.concepto_id == Concepto.id, gm.year == y, gm.month == m))
+        .group_by(Concepto.nombre_normalizado)
+        .subquery()
+    )
+    return db.session.execute(
+        db.select(grupos.c.clave, Concepto.nombre, Area.nombre, grupos.c.presupuestado, grupos.c.gastado,
+                  grupos.c.conceptos)
+        .join(Concepto, Concepto.id == grupos.c.primer_id)
+        .outerjoin(Area, Area.id == Concepto.area_id)
+        .order_by(grupos.c.primer_id)
+    ).all()
+
+
+def detalle_gastos_mes(y, m):
+    first_day, next_month_first = rango_mes(y, m)
+    rows = db.session.execute(
+        db.select(Concepto.nombre_normalizado, Gasto.fecha, User.name, Gasto.monto)
+        .join(User, User.id == Gasto.usuario_id)
+        .join(Concepto, Concepto.id == Gasto.concepto_id)
+        .where(Gasto.fecha >= first_day, Gasto.fecha < next_month_first)
+        # Dentro de cada grupo: por concepto y luego en orden de registro
+        .order_by(Gasto.concepto_id, Gasto.id)
+    )
+    return [DetalleGasto(*r) for r in rows]
+
+
+def marca_modificacion(desde, hasta, variante=()):
+    # Validador (etag, last_modified) del reporte de los meses desde..hasta, en una sola
+    # consulta sobre los índices de gasto_mensual y presupuesto_mensual y la marca del catálogo
+    gm, pm = GastoMensual, PresupuestoMensual
+    en_rango_gm = db.and_(db.tuple_(gm.year, gm.month) >= desde, db.tuple_(gm.year, gm.month) <= hasta)
+    en_rango_pm = db.and_(db.tuple_(pm.year, pm.month) >= desde, db.tuple_(pm.year, pm.month) <= hasta)
+    fila = db.session.execute(db.select(
+        db.select(db.func.max(gm.actualizado)).where(en_rango_gm).scalar_subquery(),
+        db.select(db.func.coalesce(db.func.sum(gm.cantidad), 0)).where(en_rango_gm).scalar_subquery(),
+        db.select(db.func.coalesce(db.func.sum(gm.total), 0.0)).where(en_rango_gm).scalar_subquery(),
+        db.select(db.func.max(pm.actualizado)).where(en_rango_pm).scalar_subquery(),
+        db.select(db.func.count(pm.id)).where(en_rango_pm).scalar_subquery(),
+        db.select(MarcaCambios.actualizado).where(MarcaCambios.clave == 'catalogo').scalar_subquery(),
+    )).one()
+    etag = hashlib.sha1(repr((desde, hasta, tuple(fila), tuple(variante))).encode()).hexdigest()
+    marcas = [fila[0], fila[3], fila[5]]
+    last_modified = max((mk for mk in marcas if mk is not None), default=None)
+    return etag, last_modified
+
+
+def construir_reporte_mes(y, m, incluir_detalle=True):
+    # Número fijo de consultas sin importar cuántos conceptos o gastos existan:
+    # grupos con presupuesto y gastado, detalle de gastos y usuarios.
+    detalle_por_grupo = {}
+    if incluir_detalle:
+        for d in detalle_gastos_mes(y, m):
+            detalle_por_grupo.setdefault(d.grupo, []).append(d)
+
+    # Grupos por nombre de concepto normalizado (trim, colapsar espacios, sin acentos, lower)
+    group_map = {}
+    for key, nombre, area_nombre, presupuestado, gastado, conceptos in grupos_mes(y, m):
+        name_collapsed = normalizar_nombre(nombre)[1]
+        group_map[key] = {
+            'concepto_name': name_collapsed if name_collapsed else nombre,
+            'area_name': area_nombre or '',
+            'presupuestado': float(presupuestado or 0),
+            'gastado': float(gastado or 0),
+            'gastos': detalle_por_grupo.get(key, []),
+            'group_key': key.replace(' ', '-'),
+            'source_count': conceptos,
+        }
+
+    # Construir reporte final desde los grupos
+    report = []
+    total_pres = 0.0
+    total_gasto = 0.0
+    total_pend = 0.0
+    total_exceso = 0.0
+    counts = { 'green': 0, 'yellow': 0, 'lilac': 0, 'orange': 0, 'red': 0 }
+
+    for g in group_map.values():
+        presupuestado = g['presupuestado']
+        gastado = g['gastado']
+        pendiente = presupuestado - gastado
+        exceso = max(gastado - presupuestado, 0)
+
+        state = clasificar_estado(presupuestado, pendiente)
+        counts[state] += 1
+
+        total_pres += presupuestado
+        total_gasto += gastado
+        total_pend += pendiente
+        total_exceso += exceso
+
+        report.append({
+            'area_name': g['area_name'],
+            'concepto_name': g['concepto_name'],
+            'presupuestado': presupuestado,
+            'gastado': gastado,
+            'pendiente': pendiente,
+            'exceso': exceso,
+            'state': state,
+            'gastos': g['gastos'],
+            'group_key': g['group_key'],
+            'source_count': g['source_count'],
+        })
+
+    # Calcular aporte esperado por usuario
+    aportes_usuarios = []
+    for nombre, aporte in db.session.execute(db.select(User.name, User.aporte).order_by(User.id)):
+        aportes_usuarios.append({
+            'nombre': nombre,
+            'porcentaje': aporte * 100,
+            'aporte_esperado': total_pres * aporte
+        })
+
+    return {
+        'report': report,
+        'total_pres': total_pres,
+        'total_gasto': total_gasto,
+        'total_pend': total_pend,
+        'total_exceso': total_exceso,
+        'counts': counts,
+        'aportes_usuarios': aportes_usuarios,
+    }
+
+
+ENCABEZADO_CSV = ['Año', 'Mes', 'Área', 'Concepto', 'Presupuestado', 'Gastado', 'Pendiente', 'Exceso']
+ENCABEZADO_CSV_DETALLE = ['Año', 'Mes', 'Fecha', 'Área', 'Concepto', 'Usuario', 'Monto']
+
+
+class _Linea:
+    # Objeto "archivo" para csv.writer que devuelve la línea en lugar de acumularla
+    def write(self, value):
+        return value
+
+
+def generar_csv(filas):
+    # Convierte un iterable de filas en líneas CSV sin construir el archivo en memoria
+    writer = csv.writer(_Linea())
+    for fila in filas:
+        yield writer.writerow(fila)
+
+
+def meses_en_rango(desde, hasta):
+    # desde/hasta: (year, month), ambos incluidos
+    y, m = desde
+    while (y, m) <= hasta:
+        yield y, m
+        y, m = (y + 1, 1) if m == 12 else (y, m + 1)
+
+
+def _filas_resumen(y, m, report):
+    for row in report:
+        yield [
+            y,
+            m,
+            row['area_name'],
+            row['concepto_name'],
+            int(round(row['presupuestado'])),
+            int(round(row['gastado'])),
+            int(round(row['pendiente'])),
+            int(round(row['exceso'])),
+        ]
+
+
+def _fila_totales(total_pres, total_gasto, total_pend, total_exceso):
+    return ['Totales', '', '', '', int(round(total_pres)), int(round(total_gasto)), int(round(total_pend)), int(round(total_exceso))]
+
+
+def filas_csv_mes(y, m):
+    datos = construir_reporte_mes(y, m, incluir_detalle=False)
+    yield ENCABEZADO_CSV
+    yield from _filas_resumen(y, m, datos['report'])
+    yield []
+    yield _fila_totales(datos['total_pres'], datos['total_gasto'], datos['total_pend'], datos['total_exceso'])
+
+
+def filas_csv_rango(desde, hasta, tamano_lote=1000):
+    # Resumen mes a mes (acotado por la cantidad de conceptos) seguido del detalle de
+    # cada gasto, leído por lotes con yield_per para que la memoria no crezca con el rango.
+    yield ENCABEZADO_CSV
+    totales = [0.0, 0.0, 0.0, 0.0]
+    for y, m in meses_en_rango(desde, hasta):
+        datos = construir_reporte_mes(y, m, incluir_detalle=False)
+        yield from _filas_resumen(y, m, datos['report'])
+        totales[0] += datos['total_pres']
+        totales[1] += datos['total_gasto']
+        totales[2] += datos['total_pend']
+        totales[3] += datos['total_exceso']
+    yield []
+    yield _fila_totales(*totales)
+
+    yield []
+    yield ENCABEZADO_CSV_DETALLE
+    first_day, _ = rango_mes(*desde)
+    _, fin = rango_mes(*hasta)
+    stmt = (
+        db.select(Gasto.fecha, Area.nombre, Concepto.nombre, User.name, Gasto.monto)
+        .join(Concepto, Concepto.id == Gasto.concepto_id)
+        .outerjoin(Area, Area.id == Concepto.area_id)
+        .join(User, User.id == Gasto.usuario_id)
+        .where(Gasto.fecha >= first_day, Gasto.fecha < fin)
+        .order_by(Gasto.fecha, Gasto.id)
+        .execution_options(yield_per=tamano_lote)
+    )
+    for fecha, area_nombre, concepto_nombre, usuario, monto in db.session.execute(stmt):
+        yield [fecha.year, fecha.month, fecha.strftime('%Y-%m-%d'), area_nombre or '', concepto_nombre, usuario, int(round(monto))]
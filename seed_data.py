@@ -1,6 +1,7 @@
-from datetime import datetime, date
+from datetime import datetime
 from app import app
 from models import db, User, Area, Concepto, Gasto, PresupuestoMensual
+from reportes import rango_mes
 
 # Helper to get or create
 
@@ -43,17 +44,13 @@ def upsert_presupuesto(concepto_id: int, year: int, month: int, valor: float):
 
 def ensure_gasto_mes(concepto_id: int, usuario_id: int, year: int, month: int, monto: float):
     # check if there's already any gasto for this concepto in this month
-    first_day = date(year, month, 1)
-    if month == 12:
-        next_month_first = date(year + 1, 1, 1)
-    else:
-        next_month_first = date(year, month + 1, 1)
+    first_day, next_month_first = rango_mes(year, month)
     exists = (
         db.session.query(Gasto)
         .filter(
             Gasto.concepto_id == concepto_id,
-            Gasto.fecha >= datetime.combine(first_day, datetime.min.time()),
-            Gasto.fecha < datetime.combine(next_month_first, datetime.min.time()),
+            Gasto.fecha >= first_day,
+            Gasto.fecha < next_month_first,
         )
         .first()
         is not None